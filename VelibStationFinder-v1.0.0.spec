@@ -1,39 +1,83 @@
 # -*- mode: python ; coding: utf-8 -*-
+import glob
+import os
 
+# onedir builds start much faster than onefile ones: nothing has to be
+# unpacked to a temporary folder on every launch. Set VELIB_ONEFILE=1 to
+# get the single executable back.
+ONEFILE = os.environ.get('VELIB_ONEFILE') == '1'
+
+# Ship the newest recorded snapshot so the very first launch has something to show
+snapshots = sorted(glob.glob('velib_data_*.json'))[-1:]
 
 a = Analysis(
     ['velib_gui.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    datas=[(snapshot, '.') for snapshot in snapshots],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # Modules the desktop app never uses (web app, icon script, dev tools)
+    excludes=[
+        'flask', 'flask_cors', 'werkzeug', 'jinja2', 'markupsafe', 'itsdangerous',
+        'PIL', 'numpy', 'pytest', 'setuptools', 'pkg_resources',
+        'pydoc', 'doctest', 'lib2to3', 'xmlrpc', 'tkinter.test',
+    ],
     noarchive=False,
-    optimize=0,
+    optimize=1,
 )
 pyz = PYZ(a.pure)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.datas,
-    [],
-    name='VelibStationFinder-v1.0.0',
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=False,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-    icon=['assets\\velib_icon.ico'],
-)
+if ONEFILE:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.datas,
+        [],
+        name='VelibStationFinder-v1.0.0',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        runtime_tmpdir=None,
+        console=False,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+        icon=['assets\\velib_icon.ico'],
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        [],
+        exclude_binaries=True,
+        name='VelibStationFinder-v1.0.0',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        # UPX compressed binaries have to be decompressed at every start
+        upx=False,
+        console=False,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+        icon=['assets\\velib_icon.ico'],
+    )
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        name='VelibStationFinder-v1.0.0',
+    )
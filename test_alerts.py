@@ -0,0 +1,152 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import threading
+
+import pytest
+
+from velib_alerts import AlertEngine, QueueSink, _pinned_post, check_webhook_target
+
+
+def make_station(ebike, code="1001"):
+    return {"stationcode": code, "name": "Test", "capacity": 20, "ebike": ebike, "mechanical": 0}
+
+
+def make_engine():
+    sink = QueueSink()
+    return AlertEngine({"queue": sink}), sink
+
+
+def test_notifies_on_transition_only():
+    engine, sink = make_engine()
+    engine.add_watch("1001", "ebike", ">=", 3, cooldown=0, station=make_station(0), now=0)
+
+    assert engine.evaluate([make_station(3)], now=10) == 1
+    # Still true: no new notification
+    assert engine.evaluate([make_station(5)], now=20) == 0
+    assert engine.evaluate([make_station(1)], now=30) == 0
+    assert engine.evaluate([make_station(4)], now=40) == 1
+    assert [n["value"] for n in sink.since()] == [3, 4]
+
+
+def test_other_stations_are_ignored():
+    engine, sink = make_engine()
+    engine.add_watch("1001", "ebike", ">=", 3, cooldown=0)
+    assert engine.evaluate([make_station(9, code="2002")], now=10) == 0
+    assert sink.since() == []
+
+
+def test_transition_during_cooldown_is_delivered_afterwards():
+    engine, sink = make_engine()
+    engine.add_watch("1001", "ebike", ">=", 3, cooldown=300)
+
+    assert engine.evaluate([make_station(3)], now=1000) == 1
+    engine.evaluate([make_station(0)], now=1060)
+    # Back above the threshold within the cooldown: held back, not lost
+    assert engine.evaluate([make_station(5)], now=1120) == 0
+    # The station does not change again, the held back transition still goes out
+    assert engine.evaluate([], now=1200) == 0
+    assert engine.evaluate([], now=1300) == 1
+    assert [(n["value"], n["time"]) for n in sink.since()] == [(3, 1000), (5, 1300)]
+    assert engine.pending == {}
+
+
+def test_held_back_transition_dropped_if_condition_clears():
+    engine, sink = make_engine()
+    watch = engine.add_watch("1001", "ebike", ">=", 3, cooldown=300)
+    engine.evaluate([make_station(3)], now=1000)
+    engine.evaluate([make_station(0)], now=1060)
+    engine.evaluate([make_station(5)], now=1120)
+    engine.evaluate([make_station(0)], now=1180)
+
+    assert engine.evaluate([], now=1400) == 0
+    assert len(sink.since()) == 1
+    assert not watch.matching
+
+
+def test_removed_watch_is_not_delivered():
+    engine, sink = make_engine()
+    watch = engine.add_watch("1001", "ebike", ">=", 3, cooldown=300)
+    engine.evaluate([make_station(3)], now=1000)
+    engine.evaluate([make_station(0)], now=1060)
+    engine.evaluate([make_station(5)], now=1120)
+
+    assert engine.remove_watch(watch.id)
+    assert engine.evaluate([], now=1400) == 0
+    assert len(sink.since()) == 1
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/hook",
+    "http://169.254.169.254/latest/meta-data",
+    "http://10.0.0.1/hook",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "ftp://example.com/hook",
+    "not a url",
+])
+def test_webhook_targets_on_the_local_network_are_refused(url):
+    with pytest.raises(ValueError):
+        check_webhook_target(url)
+
+
+def test_webhook_allow_list():
+    with pytest.raises(ValueError):
+        check_webhook_target("https://8.8.8.8/hook", allowed_hosts={"hooks.example.com"})
+    check_webhook_target("https://8.8.8.8/hook")
+
+
+@pytest.mark.parametrize("definition", [
+    {"stationcode": {"a": 1}},
+    {"stationcode": True},
+    {"stationcode": ""},
+    {"cooldown": "nan"},
+    {"cooldown": "inf"},
+    {"threshold": float("inf")},
+    {"threshold": "many"},
+])
+def test_invalid_watches_are_refused(definition):
+    engine, _ = make_engine()
+    arguments = dict({"stationcode": "1001", "metric": "ebike", "op": ">=", "threshold": 3}, **definition)
+    with pytest.raises(ValueError):
+        engine.add_watch(**arguments)
+
+
+def test_integer_station_codes():
+    engine, _ = make_engine()
+    assert engine.add_watch(1001, "ebike", ">=", 3).stationcode == "1001"
+
+
+def test_notifications_are_filtered_by_token():
+    engine, sink = make_engine()
+    mine = engine.add_watch("1001", "ebike", ">=", 3, cooldown=0)
+    engine.add_watch("1001", "ebike", ">=", 1, cooldown=0)
+    engine.evaluate([make_station(3)], now=10)
+
+    assert engine.watch_ids([mine.token, "forged"]) == {mine.id}
+    assert [n["watch_id"] for n in sink.since(watch_ids=engine.watch_ids([mine.token]))] == [mine.id]
+    engine.remove_watch(mine.id)
+    assert engine.watch_ids([mine.token]) == set()
+
+
+def test_webhook_connects_to_the_checked_address():
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(self.headers["Host"])
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        port = server.server_address[1]
+        # hooks.invalid never resolves: the request can only go to the given address
+        response = _pinned_post(f"http://hooks.invalid:{port}/hook", "127.0.0.1", {"seq": 1}, 5)
+    finally:
+        server.shutdown()
+    assert response.status_code == 204
+    assert received == [f"hooks.invalid:{port}"]
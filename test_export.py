@@ -0,0 +1,93 @@
+import csv
+from datetime import datetime
+import gzip
+import io
+import json
+
+import pytest
+
+import velib_export
+from velib_export import append_history, export, iter_rows, parse_columns
+
+DAY = 86400
+# Noon on three consecutive days, local time
+FIRST = datetime(2024, 3, 4, 12).timestamp()
+TIMES = [FIRST, FIRST + DAY, FIRST + 2 * DAY]
+
+
+def make_stations(count, ebike=1):
+    return [
+        {"stationcode": str(1000 + i), "name": f"Station {i}", "capacity": 20, "ebike": ebike, "mechanical": 2,
+         "is_installed": "OUI", "is_renting": "OUI", "is_returning": "OUI",
+         "coordonnees_geo": {"lat": 48.85, "lon": 2.35}}
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def history(tmp_path):
+    for ebike, taken_at in enumerate(TIMES):
+        append_history(str(tmp_path), make_stations(3, ebike), taken_at)
+    return str(tmp_path)
+
+
+def test_from_to_filtering(history):
+    rows = list(iter_rows(FIRST + DAY, FIRST + DAY, history_dir=history))
+    assert [row["ebike"] for row in rows] == [1, 1, 1]
+    assert len(list(iter_rows(FIRST + 1, None, history_dir=history))) == 6
+    assert len(list(iter_rows(None, FIRST, history_dir=history))) == 3
+
+
+def test_days_outside_the_range_are_not_opened(history, tmp_path):
+    # Unreadable, so opening it would fail the export
+    last_day = tmp_path / f"history_{datetime.fromtimestamp(TIMES[2]):%Y%m%d}.ndjson"
+    last_day.write_text("not json\n")
+    rows = list(iter_rows(FIRST, FIRST + DAY, history_dir=history))
+    assert len(rows) == 6
+
+
+def test_empty_range_does_not_fall_back_to_recorded_snapshots(history, monkeypatch):
+    monkeypatch.setattr(velib_export, "recorded_snapshots", lambda: pytest.fail("recorded snapshots read"))
+    assert list(iter_rows(FIRST + 10 * DAY, None, history_dir=history)) == []
+
+
+def test_falls_back_to_recorded_snapshots_without_history(tmp_path, monkeypatch):
+    recorded = []
+    for count, taken_at in zip((2, 4), TIMES):
+        path = tmp_path / f"velib_data_{datetime.fromtimestamp(taken_at):%Y%m%d_%H%M%S}.json"
+        path.write_text(json.dumps({"results": make_stations(count)}))
+        recorded.append(str(path))
+    monkeypatch.setattr(velib_export, "recorded_snapshots", lambda: list(reversed(recorded)))
+
+    assert len(list(iter_rows(history_dir=str(tmp_path / "none")))) == 6
+    assert len(list(iter_rows(FIRST + 1, None))) == 4
+    assert list(iter_rows(recorded=False)) == []
+
+
+def test_column_selection(history):
+    rows = iter_rows(history_dir=history)
+    lines = b"".join(export(rows, "ndjson", ("stationcode", "ebike"))).decode().splitlines()
+    assert json.loads(lines[0]) == {"stationcode": "1000", "ebike": 0}
+
+    table = list(csv.reader(io.StringIO(b"".join(export(iter_rows(history_dir=history), "csv", ("name",))).decode())))
+    assert table[0] == ["name"] and len(table) == 10
+    with pytest.raises(ValueError):
+        parse_columns("stationcode,bogus")
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "csv"])
+def test_gzip_decompresses_to_the_plain_output(history, fmt, monkeypatch):
+    # Several batches, to compress more than one chunk
+    monkeypatch.setattr(velib_export, "BATCH_SIZE", 2)
+    plain = b"".join(export(iter_rows(history_dir=history), fmt))
+    compressed = b"".join(export(iter_rows(history_dir=history), fmt, compress=True))
+    assert gzip.decompress(compressed) == plain
+
+
+def test_parquet_reads_back(history, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(velib_export, "BATCH_SIZE", 4)
+    table = pq.read_table(io.BytesIO(b"".join(export(iter_rows(history_dir=history), "parquet", ("stationcode", "ebike")))))
+    assert table.num_rows == 9
+    assert table.column_names == ["stationcode", "ebike"]
+    assert table.column("ebike").to_pylist() == [0, 0, 0, 1, 1, 1, 2, 2, 2]
@@ -0,0 +1,61 @@
+from velib_flows import FlowEngine
+
+
+def make_station(code, ebike, mechanical):
+    return {"stationcode": code, "name": f"Station {code}", "ebike": ebike, "mechanical": mechanical}
+
+
+def test_pickups_and_returns():
+    engine = FlowEngine()
+    engine.update([make_station("1", 5, 5), make_station("2", 0, 0)], timestamp=0)
+    assert engine.update([make_station("1", 3, 6), make_station("2", 0, 0)], timestamp=60) == 1
+
+    flows = engine.flows("15m")
+    assert flows["network"]["pickups_ebike"] == 2
+    assert flows["network"]["returns_mechanical"] == 1
+    assert [station["stationcode"] for station in flows["stations"]] == ["1"]
+    assert flows["stations"][0]["net"] == -1
+
+
+def test_window_expiry():
+    engine = FlowEngine({"short": 300, "long": 3600})
+    engine.update([make_station("1", 5, 0)], timestamp=0)
+    engine.update([make_station("1", 4, 0)], timestamp=60)
+    engine.update([make_station("1", 2, 0)], timestamp=240)
+    assert engine.flows("short")["network"]["pickups"] == 3
+
+    # The polls with pickups leave the short window one by one
+    engine.update([make_station("1", 2, 0)], timestamp=360)
+    assert engine.flows("short")["network"]["pickups"] == 2
+    engine.update([make_station("1", 2, 0)], timestamp=540)
+    short = engine.flows("short")
+    assert short["network"]["pickups"] == 0
+    assert short["stations"] == []
+    # Only the two quiet polls are left in it
+    assert short["polls"] == 2
+    assert engine.flows("long")["network"]["pickups"] == 3
+    assert engine.flows("long", stationcode="1")["stations"][0]["pickups_ebike"] == 3
+
+
+def test_long_gap_is_a_new_baseline():
+    engine = FlowEngine()
+    engine.update([make_station("1", 5, 5)], timestamp=0)
+    assert engine.update([make_station("1", 0, 0)], timestamp=3600) == 0
+    assert engine.flows("24h")["network"]["pickups"] == 0
+    # Diffed again from the new baseline
+    engine.update([make_station("1", 1, 0)], timestamp=3660)
+    assert engine.flows("24h")["network"]["returns"] == 1
+
+
+def test_missing_stations_keep_their_counts():
+    full = FlowEngine()
+    changed_only = FlowEngine()
+    stations = [make_station(str(code), 3, 3) for code in range(10)]
+    full.update(stations, timestamp=0)
+    changed_only.update(stations, timestamp=0)
+
+    stations[4] = make_station("4", 1, 5)
+    full.update(stations, timestamp=60)
+    changed_only.update([stations[4]], timestamp=60)
+
+    assert full.flows("1h") == changed_only.flows("1h")
@@ -0,0 +1,105 @@
+from array import array
+from datetime import datetime
+
+import pytest
+
+from velib_forecast import ALPHA, BUCKETS, MAX_RATE_GAP, ForecastEngine, _empty_probability, _ewm, bucket_of
+
+# Monday 1 January 2024, local time
+MONDAY = datetime(2024, 1, 1).timestamp()
+
+
+def make_station(ebike, mechanical=0, code="1001"):
+    return {"stationcode": code, "ebike": ebike, "mechanical": mechanical}
+
+
+def cell(engine, kind, field, timestamp, code="1001"):
+    return engine.stats[kind][field][engine.rows[code] * BUCKETS + bucket_of(timestamp)]
+
+
+def test_ewm_update():
+    means, variances = array('f', [0.0]), array('f', [0.0])
+    _ewm(means, variances, 0, 2, True)
+    assert (means[0], variances[0]) == (2, 0)
+    _ewm(means, variances, 0, 4, False)
+    assert means[0] == pytest.approx(2 + ALPHA * 2)
+    assert variances[0] == pytest.approx((1 - ALPHA) * ALPHA * 4)
+    # A constant series converges to its value with no variance
+    for _ in range(200):
+        _ewm(means, variances, 0, 7, False)
+    assert means[0] == pytest.approx(7, abs=1e-3)
+    assert variances[0] == pytest.approx(0, abs=1e-3)
+
+
+def test_bucket_selection():
+    assert bucket_of(MONDAY + 30 * 60) == 0
+    assert bucket_of(MONDAY + 9 * 3600 + 59 * 60) == 9
+    # Sunday 23:59, the last bucket of the week
+    assert bucket_of(MONDAY + 7 * 86400 - 60) == BUCKETS - 1
+    assert bucket_of(MONDAY + 7 * 86400) == 0
+
+
+def test_forecast_uses_the_target_bucket():
+    engine = ForecastEngine()
+    # Usually 10 e-bikes at 9:00 on Mondays, 2 now at 8:50
+    engine.update([make_station(10)], MONDAY + 9 * 3600 - 7 * 86400)
+    engine.update([make_station(2)], MONDAY + 8 * 3600 + 50 * 60)
+    now = MONDAY + 8 * 3600 + 50 * 60
+
+    # Still in the 8:00 bucket, which only has the current count
+    assert engine.forecast("1001", minutes=5, now=now)["ebike"]["expected"] == 2
+    # 9:05 is in the 9:00 bucket: pulled towards its usual level
+    expected = engine.forecast("1001", minutes=15, now=now)["ebike"]["expected"]
+    assert expected == pytest.approx(2 + (10 - 2) * 15 / 75)
+    assert engine.forecast("unknown") is None
+
+
+def test_rates_only_learned_from_close_polls():
+    engine = ForecastEngine()
+    engine.update([make_station(2)], MONDAY)
+    # Same time again, then a gap longer than MAX_RATE_GAP: no rate
+    engine.update([make_station(2)], MONDAY)
+    later = MONDAY + MAX_RATE_GAP + 60
+    engine.update([make_station(8)], later)
+    index = engine.rows["1001"] * BUCKETS + bucket_of(later)
+    assert engine.rate_count[index] == 0
+
+    # Two minutes later, 4 more e-bikes: 2 per minute
+    engine.update([make_station(12)], later + 120)
+    assert engine.rate_count[index] == 1
+    assert cell(engine, "ebike", "rate_mean", later) == pytest.approx(2)
+    assert cell(engine, "mechanical", "rate_mean", later) == 0
+
+
+def test_counters_saturate():
+    engine = ForecastEngine()
+    engine.update([make_station(1)], MONDAY)
+    index = engine.rows["1001"] * BUCKETS + bucket_of(MONDAY)
+    engine.level_count[index] = engine.rate_count[index] = 0xFFFF
+    engine.update([make_station(2)], MONDAY + 60)
+    assert engine.level_count[index] == engine.rate_count[index] == 0xFFFF
+
+
+def test_empty_risk_at_the_extremes():
+    engine = ForecastEngine()
+    for poll in range(30):
+        engine.update([make_station(0, code="empty"), make_station(12, 8, code="full")], MONDAY + 60 * poll)
+    now = MONDAY + 60 * 29
+
+    empty = engine.forecast("empty", minutes=15, now=now)
+    assert empty["total"]["empty_risk"] == 1.0
+    assert empty["mechanical"]["empty_risk"] == 1.0
+    full = engine.forecast("full", minutes=15, now=now)
+    assert full["total"]["empty_risk"] == 0.0
+
+
+@pytest.mark.parametrize("mean, variance, low, high", [
+    (0, 0, 1, 1),
+    (0, 5, 1, 1),
+    (0.05, 0.05, 0.9, 1),
+    (3, 3, 0.04, 0.06),
+    (3, 30, 0.3, 0.6),
+    (20, 1, 0, 1e-6),
+])
+def test_empty_probability(mean, variance, low, high):
+    assert low <= _empty_probability(mean, variance) <= high
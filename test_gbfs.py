@@ -0,0 +1,127 @@
+from velib_gbfs import GBFSFetcher, MIN_TTL
+
+DISCOVERY = "https://example.com/gbfs.json"
+
+
+class FakeGBFS(GBFSFetcher):
+    """Serves the feeds from memory and counts the downloads"""
+    def __init__(self, statuses, information, ttl=60):
+        super().__init__(gbfs_url=DISCOVERY)
+        self.statuses = statuses
+        self.information_feed = information
+        self.ttl = ttl
+        self.last_updated_value = 1
+        self.downloads = {"station_status": 0, "station_information": 0}
+
+    def _get(self, url):
+        if url == DISCOVERY:
+            return {"data": {"en": {"feeds": [
+                {"name": name, "url": name} for name in ("station_status", "station_information")
+            ]}}}
+        self.downloads[url] += 1
+        if url == "station_information":
+            return {"data": {"stations": self.information_feed}}
+        return {"ttl": self.ttl, "last_updated": self.last_updated_value, "data": {"stations": self.statuses}}
+
+    def publish(self, statuses):
+        """A new station_status, available right away"""
+        self.statuses = statuses
+        self.last_updated_value += 1
+        self.next_refresh = 0.0
+
+
+def status(station_id, ebike, reported):
+    return {
+        "station_id": station_id, "num_bikes_available": ebike, "num_docks_available": 10,
+        "num_bikes_available_types": [{"ebike": ebike}, {"mechanical": 0}],
+        "is_installed": 1, "is_renting": 1, "is_returning": 1, "last_reported": reported,
+    }
+
+
+def information(station_id):
+    return {"station_id": station_id, "stationCode": f"C{station_id}", "name": f"Station {station_id}",
+            "lat": 48.85, "lon": 2.35, "capacity": 20}
+
+
+def test_unchanged_last_reported_reuses_stations():
+    fetcher = FakeGBFS([status(1, 2, 100), status(2, 3, 100)], [information(1), information(2)])
+    first = fetcher.get_stations()["results"]
+    assert fetcher.delta is None
+
+    fetcher.publish([status(1, 2, 100), status(2, 5, 160)])
+    second = fetcher.get_stations()["results"]
+
+    assert second[0] is first[0]
+    assert second[1] is not first[1] and second[1]["ebike"] == 5
+    assert fetcher.last_changed == 1
+    assert fetcher.delta["since"] is first
+    assert fetcher.delta["changed"] == [second[1]]
+    assert fetcher.delta["removed"] == []
+
+
+def test_removed_stations_are_in_the_delta():
+    fetcher = FakeGBFS([status(1, 2, 100), status(2, 3, 100)], [information(1), information(2)])
+    fetcher.get_stations()
+    fetcher.publish([status(1, 2, 100)])
+    fetcher.get_stations()
+    assert fetcher.delta["changed"] == []
+    assert fetcher.delta["removed"] == ["C2"]
+
+
+def test_same_feed_returns_the_previous_result():
+    fetcher = FakeGBFS([status(1, 2, 100)], [information(1)])
+    data = fetcher.get_stations()
+    # ttl not expired: no download at all
+    assert fetcher.get_stations() is data
+    assert fetcher.downloads["station_status"] == 1
+    # Expired but last_updated did not move
+    fetcher.next_refresh = 0.0
+    assert fetcher.get_stations() is data
+    assert fetcher.downloads["station_status"] == 2
+
+
+def test_ttl_zero_is_kept():
+    fetcher = FakeGBFS([status(1, 2, 100)], [information(1)], ttl=0)
+    fetcher.get_stations()
+    assert fetcher.seconds_until_refresh() <= MIN_TTL
+
+
+def test_missing_information_is_not_downloaded_every_poll():
+    fetcher = FakeGBFS([status(1, 2, 100), status(9, 1, 100)], [information(1)])
+    fetcher.get_stations()
+    assert fetcher.missing_information == {"9"}
+    for reported in (160, 220, 280):
+        fetcher.publish([status(1, 2, reported), status(9, 1, reported)])
+        fetcher.get_stations()
+    assert fetcher.downloads["station_information"] == 1
+
+    # A new unknown station does trigger a refresh
+    fetcher.information_feed = [information(1), information(9), information(10)]
+    fetcher.publish([status(1, 2, 300), status(9, 1, 300), status(10, 4, 300)])
+    results = fetcher.get_stations()["results"]
+    assert fetcher.downloads["station_information"] == 2
+    assert fetcher.missing_information == set()
+    assert [station["name"] for station in results] == ["Station 1", "Station 9", "Station 10"]
+
+
+def test_failed_poll_is_retried_with_the_same_feed():
+    fetcher = FakeGBFS([status(1, 2, 100)], [information(1)])
+    fetcher.get_stations()
+    get = fetcher._get
+
+    def information_down(url):
+        if url == "station_information":
+            raise OSError("network is down")
+        return get(url)
+
+    # A new station needs station_information, which cannot be downloaded
+    fetcher._get = information_down
+    fetcher.publish([status(1, 7, 160), status(2, 1, 160)])
+    assert fetcher.get_stations()["results"][0]["ebike"] == 2
+    assert fetcher.last_updated == 1
+
+    # Same station_status once it is back: applied, not taken as unchanged
+    fetcher._get = get
+    fetcher.next_refresh = 0.0
+    assert [station["ebike"] for station in fetcher.get_stations()["results"]] == [7, 1]
+    assert fetcher.last_updated == 2
@@ -0,0 +1,92 @@
+import random
+import threading
+
+from velib_registry import StationSystem, SystemRegistry
+
+
+def make_station(code, rng):
+    capacity = rng.randint(10, 30)
+    ebike = rng.randint(0, capacity // 2)
+    return {
+        "stationcode": code,
+        "name": f"Station {code}",
+        "capacity": capacity,
+        "ebike": ebike,
+        "mechanical": rng.randint(0, capacity - ebike),
+        "is_installed": "OUI",
+        "is_renting": "OUI",
+        "is_returning": "OUI",
+        "coordonnees_geo": {"lat": 48.8 + rng.random() / 10, "lon": 2.3 + rng.random() / 10},
+    }
+
+
+class DeltaFetcher:
+    """Publishes a prepared series of snapshots with GBFS style deltas"""
+    def __init__(self, snapshots):
+        self.snapshots = iter(snapshots)
+        self.delta = None
+        self._data = None
+
+    def seconds_until_refresh(self):
+        return 0.0
+
+    def get_stations(self):
+        stations, delta = next(self.snapshots)
+        self.delta = dict(delta, since=self._data["results"]) if delta is not None else None
+        self._data = {"total_count": len(stations), "results": stations}
+        return self._data
+
+
+def snapshot_series(polls, seed=35):
+    rng = random.Random(seed)
+    stations = {str(1000 + i): make_station(str(1000 + i), rng) for i in range(100)}
+    series = [(list(stations.values()), None)]
+    for _ in range(polls):
+        changed = []
+        for code in rng.sample(sorted(stations), 10):
+            # Counts move, stations stay where they are
+            station = dict(make_station(code, rng), coordonnees_geo=stations[code]["coordonnees_geo"])
+            stations[code] = station
+            changed.append(station)
+        series.append((list(stations.values()), {"changed": changed, "removed": []}))
+    return series
+
+
+def state(system):
+    return (
+        system.summary.as_dict()["network"],
+        system.flows.flows("1h"),
+        sorted(system.by_code),
+        system.trip_planner.plan((48.82, 2.32), (48.88, 2.38)),
+        [(station["stationcode"], station["ebike"]) for station in system.search_index.search("Station 10")],
+    )
+
+
+def test_deltas_match_full_rebuilds():
+    series = snapshot_series(20)
+    incremental = StationSystem("delta", lambda: DeltaFetcher(series))
+    full = StationSystem("full", lambda: DeltaFetcher((stations, None) for stations, _ in series))
+    for _ in series:
+        incremental.get_snapshot()
+        full.get_snapshot()
+        assert state(incremental) == state(full)
+
+
+def test_budget_skips_busy_systems():
+    registry = SystemRegistry(memory_budget=0)
+    rng = random.Random(0)
+    stations = [make_station(str(i), rng) for i in range(10)]
+    busy = registry.register("busy", lambda: None)
+    idle = registry.register("idle", lambda: None)
+    current = registry.register("current", lambda: None)
+    for system in (busy, idle, current):
+        system.seed(list(stations), fetched_at=0)
+
+    with busy.lock:
+        worker = threading.Thread(target=registry._enforce_budget, args=(current,))
+        worker.start()
+        worker.join(timeout=5)
+        assert not worker.is_alive()
+    assert busy.loaded
+    assert not idle.loaded
+    assert current.loaded
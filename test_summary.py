@@ -0,0 +1,63 @@
+import random
+
+from velib_summary import SummaryEngine
+
+
+def make_station(code, rng):
+    capacity = rng.randint(10, 40)
+    ebike = rng.randint(0, capacity // 2)
+    return {
+        "stationcode": code,
+        "capacity": capacity,
+        "ebike": ebike,
+        "mechanical": rng.randint(0, capacity - ebike),
+        "is_installed": "OUI",
+        "is_renting": rng.choice(["OUI", "OUI", "NON"]),
+    }
+
+
+def recompute(stations):
+    engine = SummaryEngine()
+    engine.update(stations)
+    return engine.as_dict()
+
+
+def aggregates(summary):
+    return summary["network"], summary["districts"]
+
+
+def test_deltas_match_full_recompute():
+    rng = random.Random(26)
+    codes = [str(rng.choice([1, 2, 16, 92, 93]) * 1000 + i) for i in range(300)]
+    stations = {code: make_station(code, rng) for code in codes}
+    incremental = SummaryEngine()
+    incremental.update(list(stations.values()))
+
+    for _ in range(50):
+        changed = []
+        for code in rng.sample(sorted(stations), 20):
+            stations[code] = make_station(code, rng)
+            changed.append(stations[code])
+        removed = rng.sample(sorted(stations), 2)
+        for code in removed:
+            del stations[code]
+        added = str(rng.randint(100000, 999999))
+        stations[added] = make_station(added, rng)
+        changed.append(stations[added])
+
+        incremental.update(changed, removed=removed)
+        assert aggregates(incremental.as_dict()) == aggregates(recompute(list(stations.values())))
+
+
+def test_full_snapshot_drops_missing_stations():
+    rng = random.Random(1)
+    stations = [make_station(str(1000 + i), rng) for i in range(10)]
+    engine = SummaryEngine()
+    engine.update(stations)
+
+    changed = engine.update(stations[:-1])
+
+    assert changed == {stations[-1]["stationcode"]}
+    assert aggregates(engine.as_dict()) == aggregates(recompute(stations[:-1]))
+    # Nothing changed, nothing reported
+    assert engine.update(stations[:-1]) == set()
@@ -0,0 +1,85 @@
+import math
+import random
+
+from velib_trip import TripPlanner
+
+
+def make_station(code, lat, lon, ebike=1, mechanical=1, capacity=20):
+    return {
+        "stationcode": code,
+        "name": f"Station {code}",
+        "capacity": capacity,
+        "ebike": ebike,
+        "mechanical": mechanical,
+        "is_installed": "OUI",
+        "is_renting": "OUI",
+        "is_returning": "OUI",
+        "coordonnees_geo": {"lat": lat, "lon": lon},
+    }
+
+
+def brute_force(planner, lat, lon, k, counts, allowed):
+    x, y = planner._project(lat, lon)
+    found = sorted(
+        (math.hypot(planner.x[i] - x, planner.y[i] - y), i, counts[i])
+        for i in range(len(planner.stations)) if counts[i] > 0 and allowed[i]
+    )
+    return found[:k]
+
+
+def network(count=200, seed=27):
+    rng = random.Random(seed)
+    return [
+        make_station(str(i), 48.8 + rng.random() * 0.1, 2.25 + rng.random() * 0.2,
+                     ebike=rng.choice([0, 0, 1, 3]), mechanical=rng.choice([0, 2]))
+        for i in range(count)
+    ]
+
+
+def test_nearest_matches_brute_force():
+    planner = TripPlanner(network())
+    rng = random.Random(0)
+    for _ in range(50):
+        lat, lon = 48.78 + rng.random() * 0.14, 2.2 + rng.random() * 0.3
+        for k in (1, 5):
+            assert planner.nearest(lat, lon, k, planner.bikes["ebike"], planner.renting) == \
+                brute_force(planner, lat, lon, k, planner.bikes["ebike"], planner.renting)
+
+
+def test_ring_search_terminates_far_away_and_when_short_of_candidates():
+    stations = network()
+    planner = TripPlanner(stations)
+    # Hundreds of kilometres away: the empty rings are skipped, not walked
+    assert planner.nearest(43.3, 5.4, 3, planner.bikes["any"], planner.renting) == \
+        brute_force(planner, 43.3, 5.4, 3, planner.bikes["any"], planner.renting)
+    # Fewer candidates than asked for: every ring is searched once, then it stops
+    available = sum(1 for count in planner.bikes["ebike"] if count)
+    assert len(planner.nearest(48.85, 2.35, 10 * len(stations), planner.bikes["ebike"], planner.renting)) == available
+    # Nothing available at all
+    assert planner.nearest(48.85, 2.35, 5, [0] * len(stations), planner.renting) == []
+
+
+def test_empty_planner():
+    planner = TripPlanner([make_station("1", None, None)])
+    assert planner.nearest(48.85, 2.35, 5, planner.bikes["any"], planner.renting) == []
+    assert planner.plan((48.85, 2.35), (48.86, 2.36)) == []
+
+
+def test_projection_follows_the_network_latitude():
+    stations = [make_station("1", 59.91, 10.74), make_station("2", 59.91, 10.76)]
+    planner = TripPlanner(stations)
+    # 0.02 degrees of longitude at 59.91 N
+    assert round(planner.x[1] - planner.x[0]) == 1116
+
+
+def test_updated_leaves_the_served_planner_alone():
+    stations = [make_station("1", 48.85, 2.35, ebike=1), make_station("2", 48.86, 2.36)]
+    planner = TripPlanner(stations)
+    emptied = dict(stations[0], ebike=0, mechanical=0)
+
+    patched = planner.updated([emptied, stations[1]], [emptied], [])
+
+    assert patched is not planner
+    assert planner.bikes["any"][0] == 2 and patched.bikes["any"][0] == 0
+    assert planner.stations[0] is stations[0]
+    assert planner.plan((48.85, 2.35), (48.86, 2.36))[0]["pickup"]["available"] == 2
@@ -0,0 +1,355 @@
+"""
+Station watches and alert notifications.
+
+Watches are indexed by station code, and after each refresh only the
+watches of the stations that changed in that snapshot are evaluated, so
+the cost follows the number of changes rather than the number of watches.
+
+A watch notifies when its condition becomes true (not on every refresh
+while it stays true) and at most once per cooldown period. A transition
+during the cooldown is held back, and delivered by the first evaluation
+after the cooldown if the condition still holds. Notifications are handed
+to a pluggable sink: local queue, webhook or server-sent events.
+"""
+from collections import deque
+import ipaddress
+import itertools
+import math
+import operator
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+from velib_snapshot import free_docks
+
+METRICS = {
+    "ebike": lambda station: station.get("ebike") or 0,
+    "mechanical": lambda station: station.get("mechanical") or 0,
+    "bikes": lambda station: (station.get("ebike") or 0) + (station.get("mechanical") or 0),
+    "docks": free_docks,
+}
+OPERATORS = {
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<=": operator.le,
+    "<": operator.lt,
+    "==": operator.eq,
+}
+# Minimum seconds between two notifications of the same watch
+DEFAULT_COOLDOWN = 300
+
+
+class Watch:
+    __slots__ = ("id", "stationcode", "metric", "op", "threshold", "sink", "target", "cooldown",
+                 "matching", "last_fired", "token")
+
+    def __init__(self, watch_id, stationcode, metric, op, threshold, sink, target=None, cooldown=DEFAULT_COOLDOWN):
+        self.id = watch_id
+        self.stationcode = stationcode
+        self.metric = metric
+        self.op = op
+        self.threshold = threshold
+        self.sink = sink
+        self.target = target
+        self.cooldown = cooldown
+        self.matching = False
+        self.last_fired = 0.0
+        # Secret handed to the creator only, needed to read or delete the watch
+        self.token = secrets.token_urlsafe(16)
+
+    def check(self, station):
+        """Current value of the watched metric and whether the condition holds"""
+        value = METRICS[self.metric](station)
+        return value, OPERATORS[self.op](value, self.threshold)
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "stationcode": self.stationcode,
+            "metric": self.metric,
+            "op": self.op,
+            "threshold": self.threshold,
+            "sink": self.sink,
+            "target": self.target,
+            "cooldown": self.cooldown,
+            "matching": self.matching,
+        }
+
+
+class QueueSink:
+    """Keeps the latest notifications in memory for clients to poll"""
+    def __init__(self, maxlen=10000):
+        self.notifications = deque(maxlen=maxlen)
+
+    def deliver(self, notification, watch):
+        self.notifications.append(notification)
+
+    def since(self, seq=0, limit=500, watch_ids=None):
+        """
+        Notifications with a sequence number above seq, oldest first
+        :param watch_ids: Only return the notifications of these watches
+        """
+        newer = []
+        # Walk back from the newest one: the cost follows the number of new notifications
+        for notification in reversed(self.notifications):
+            if notification["seq"] <= seq:
+                break
+            if watch_ids is None or notification["watch_id"] in watch_ids:
+                newer.append(notification)
+        newer.reverse()
+        return newer[:limit]
+
+
+def check_webhook_target(url, allowed_hosts=None):
+    """
+    Make sure a webhook cannot be used to reach the server's own network
+    :param allowed_hosts: If set, the only host names accepted
+    :return: Address the host resolved to, to connect to that one and not resolve it again
+    :raises ValueError: for a non http(s) URL, a host outside allowed_hosts, or
+        a host resolving to a loopback, private, link-local or otherwise non public address
+    """
+    parts = urlsplit(url or "")
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("webhook watches need an http(s) target URL")
+    host = parts.hostname.lower()
+    if allowed_hosts is not None and host not in allowed_hosts:
+        raise ValueError(f"webhook host '{host}' is not allowed")
+    try:
+        infos = socket.getaddrinfo(host, parts.port or 443, proto=socket.IPPROTO_TCP)
+    except (OSError, UnicodeError):
+        raise ValueError(f"cannot resolve webhook host '{host}'")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if getattr(address, "ipv4_mapped", None):
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"webhook host '{host}' resolves to a non public address")
+    return infos[0][4][0]
+
+
+def _pinned_post(url, address, json, timeout):
+    """
+    POST to url, connecting to an already checked address of its host: resolving
+    it again would let a DNS rebinding host swap in an internal address
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class PinnedAdapter(HTTPAdapter):
+        # The certificate and SNI still use the host name, only the connection goes to the address
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs["server_hostname"] = parts.hostname
+            kwargs["assert_hostname"] = parts.hostname
+            super().init_poolmanager(*args, **kwargs)
+
+    parts = urlsplit(url)
+    userinfo, _, host = parts.netloc.rpartition("@")
+    netloc = f"[{address}]" if ":" in address else address
+    if parts.port:
+        netloc += f":{parts.port}"
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    with requests.Session() as session:
+        if parts.scheme == "https":
+            session.mount("https://", PinnedAdapter())
+        return session.post(parts._replace(netloc=netloc).geturl(), json=json, headers={"Host": host},
+                            timeout=timeout, allow_redirects=False)
+
+
+class WebhookSink:
+    """POSTs each notification as JSON to the watch target URL, from a background thread"""
+    def __init__(self, timeout=5, allowed_hosts=None):
+        """
+        :param allowed_hosts: Host names webhooks may target, defaults to the
+            comma separated VELIB_WEBHOOK_HOSTS, or any public host if unset
+        """
+        self.timeout = timeout
+        if allowed_hosts is None and os.environ.get("VELIB_WEBHOOK_HOSTS"):
+            allowed_hosts = os.environ["VELIB_WEBHOOK_HOSTS"].split(",")
+        self.allowed_hosts = {host.strip().lower() for host in allowed_hosts} if allowed_hosts else None
+        self._pending = queue.Queue(maxsize=10000)
+        self._thread = None
+
+    def check_target(self, url):
+        return check_webhook_target(url, self.allowed_hosts)
+
+    def deliver(self, notification, watch):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+        try:
+            self._pending.put_nowait((watch.target, notification))
+        except queue.Full:
+            print(f"Webhook queue full, dropping notification {notification['seq']}")
+
+    def _worker(self):
+        import requests
+        while True:
+            url, notification = self._pending.get()
+            try:
+                # Checked again: the host may resolve elsewhere since the watch was created
+                address = self.check_target(url)
+                _pinned_post(url, address, notification, self.timeout)
+            except ValueError as e:
+                print(f"Refusing to deliver webhook to {url}: {e}")
+            except requests.exceptions.RequestException as e:
+                print(f"Error delivering webhook to {url}: {e}")
+
+
+class BroadcastSink:
+    """Fans notifications out to every connected server-sent events client"""
+    def __init__(self, buffer=1000):
+        self.buffer = buffer
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.buffer)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def deliver(self, notification, watch):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(notification)
+            except queue.Full:
+                # Slow client: drop rather than block the refresh
+                pass
+
+
+class AlertEngine:
+    def __init__(self, sinks=None):
+        self.sinks = sinks if sinks is not None else {"queue": QueueSink()}
+        self.watches = {}
+        # stationcode -> {watch id: watch}
+        self.index = {}
+        # watch id -> latest station data of the watches held back by their cooldown
+        self.pending = {}
+        # token -> watch id, notifications are only shown to the holders of the token
+        self.tokens = {}
+        self._ids = itertools.count(1)
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add_watch(self, stationcode, metric, op, threshold, sink="queue", target=None,
+                  cooldown=DEFAULT_COOLDOWN, station=None, now=None):
+        """
+        Register a watch
+        :param station: Current data of the station, to evaluate the watch right away
+        :return: The new Watch
+        :raises ValueError: on an invalid definition
+        """
+        # bool is an int, but not a station code
+        if isinstance(stationcode, bool) or not isinstance(stationcode, (str, int)) or stationcode == "":
+            raise ValueError("stationcode is required, as a string or an integer")
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {', '.join(METRICS)}")
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator '{op}', expected one of {', '.join(OPERATORS)}")
+        if sink not in self.sinks:
+            raise ValueError(f"Unknown sink '{sink}', expected one of {', '.join(self.sinks)}")
+        # Sinks with a target (webhooks) validate it
+        check_target = getattr(self.sinks[sink], "check_target", None)
+        if check_target is not None:
+            check_target(target)
+        try:
+            threshold = int(threshold)
+            cooldown = max(float(cooldown), 0.0)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError("threshold must be an integer and cooldown a number of seconds")
+        # A NaN cooldown never compares as elapsed nor as running, and is not valid JSON
+        if not math.isfinite(cooldown):
+            raise ValueError("cooldown must be a finite number of seconds")
+
+        with self._lock:
+            watch = Watch(next(self._ids), str(stationcode), metric, op, threshold, sink, target, cooldown)
+            self.watches[watch.id] = watch
+            self.tokens[watch.token] = watch.id
+            self.index.setdefault(watch.stationcode, {})[watch.id] = watch
+            if station is not None:
+                self._evaluate_watch(watch, station, time.time() if now is None else now)
+        return watch
+
+    def remove_watch(self, watch_id):
+        """Delete a watch, return False if it did not exist"""
+        with self._lock:
+            watch = self.watches.pop(watch_id, None)
+            if watch is None:
+                return False
+            self.pending.pop(watch_id, None)
+            del self.tokens[watch.token]
+            watches = self.index[watch.stationcode]
+            del watches[watch_id]
+            if not watches:
+                del self.index[watch.stationcode]
+            return True
+
+    def watch_ids(self, tokens):
+        """Ids of the watches created with these tokens, unknown tokens are ignored"""
+        with self._lock:
+            return {self.tokens[token] for token in tokens if token in self.tokens}
+
+    def _evaluate_watch(self, watch, station, now):
+        value, matching = watch.check(station)
+        if not matching:
+            watch.matching = False
+            self.pending.pop(watch.id, None)
+            return False
+        # Only the transition into the watched state notifies
+        if watch.matching:
+            return False
+        if now - watch.last_fired < watch.cooldown:
+            # Not matching yet: delivered once the cooldown is over, if still true
+            self.pending[watch.id] = station
+            return False
+        self.pending.pop(watch.id, None)
+        watch.matching = True
+        watch.last_fired = now
+        notification = {
+            "seq": next(self._seq),
+            "watch_id": watch.id,
+            "stationcode": watch.stationcode,
+            "name": station.get("name"),
+            "metric": watch.metric,
+            "op": watch.op,
+            "threshold": watch.threshold,
+            "value": value,
+            "time": now,
+        }
+        self.sinks[watch.sink].deliver(notification, watch)
+        return True
+
+    def evaluate(self, changed_stations, now=None):
+        """
+        Evaluate the watches of the stations that changed in the last snapshot,
+        and the held back ones whose cooldown is over
+        :param changed_stations: Iterable of station dictionaries
+        :return: Number of notifications sent
+        """
+        if now is None:
+            now = time.time()
+        sent = 0
+        with self._lock:
+            for station in changed_stations:
+                watches = self.index.get(station.get("stationcode"))
+                if not watches:
+                    continue
+                for watch in watches.values():
+                    sent += self._evaluate_watch(watch, station, now)
+            # Transitions held back by a cooldown that is now over
+            for watch_id, station in list(self.pending.items()):
+                watch = self.watches[watch_id]
+                if now - watch.last_fired >= watch.cooldown:
+                    sent += self._evaluate_watch(watch, station, now)
+        return sent
@@ -0,0 +1,262 @@
+"""
+Bulk export of historical station rows.
+
+Rows come from a generator and are encoded in small batches, so an export
+of millions of station-rows never holds more than one batch (and, for the
+recorded velib_data_*.json files, one file) in memory.
+
+History is read from the NDJSON log written by append_history when a
+history folder is configured, otherwise from the recorded snapshot files.
+"""
+import csv
+from datetime import datetime
+import glob
+import io
+import json
+import os
+import zlib
+
+from velib_snapshot import recorded_snapshots, snapshot_time
+
+EXPORT_COLUMNS = (
+    "taken_at", "stationcode", "name", "capacity", "ebike", "mechanical",
+    "is_installed", "is_renting", "is_returning", "lat", "lon",
+)
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+# Parquet type of each column (pyarrow type factory names)
+PARQUET_TYPES = {
+    "taken_at": "string", "stationcode": "string", "name": "string",
+    "capacity": "int32", "ebike": "int32", "mechanical": "int32",
+    "is_installed": "string", "is_renting": "string", "is_returning": "string",
+    "lat": "float64", "lon": "float64",
+}
+# Rows encoded together before a chunk is handed to the response
+BATCH_SIZE = 1000
+
+
+def parse_time(value):
+    """
+    Parse a from/to bound: unix timestamp or ISO 8601 date/time
+    :return: Unix timestamp, or None if no value was given
+    :raises ValueError: on anything else
+    """
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time '{value}', expected a unix timestamp or an ISO date")
+
+
+def parse_columns(value):
+    """Validate a comma separated column selection, all columns by default"""
+    if not value:
+        return EXPORT_COLUMNS
+    columns = tuple(column.strip() for column in value.split(",") if column.strip())
+    unknown = [column for column in columns if column not in EXPORT_COLUMNS]
+    if unknown or not columns:
+        raise ValueError(f"Unknown columns {', '.join(unknown)}, expected some of {', '.join(EXPORT_COLUMNS)}")
+    return columns
+
+
+def station_rows(stations, taken_at):
+    """Flatten the stations of one snapshot into export rows"""
+    stamp = datetime.fromtimestamp(taken_at).isoformat(timespec="seconds")
+    for station in stations:
+        coords = station.get("coordonnees_geo") or {}
+        yield {
+            "taken_at": stamp,
+            "stationcode": station.get("stationcode"),
+            "name": station.get("name"),
+            "capacity": station.get("capacity"),
+            "ebike": station.get("ebike"),
+            "mechanical": station.get("mechanical"),
+            "is_installed": station.get("is_installed"),
+            "is_renting": station.get("is_renting"),
+            "is_returning": station.get("is_returning"),
+            "lat": coords.get("lat"),
+            "lon": coords.get("lon"),
+        }
+
+
+def _history_file(history_dir, taken_at):
+    return os.path.join(history_dir, f"history_{datetime.fromtimestamp(taken_at):%Y%m%d}.ndjson")
+
+
+def append_history(history_dir, stations, taken_at):
+    """Append one snapshot to the daily NDJSON history log"""
+    try:
+        os.makedirs(history_dir, exist_ok=True)
+        with open(_history_file(history_dir, taken_at), "a", encoding="utf-8") as f:
+            for row in station_rows(stations, taken_at):
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Error writing history: {e}")
+
+
+def _in_range(stamp, start, end):
+    return (start is None or stamp >= start) and (end is None or stamp <= end)
+
+
+def _history_rows(files, start, end):
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if _in_range(datetime.fromisoformat(row["taken_at"]).timestamp(), start, end):
+                    yield row
+
+
+def _recorded_rows(files, start, end):
+    for path in files:
+        taken_at = snapshot_time(path)
+        if not _in_range(taken_at, start, end):
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Skipping unreadable snapshot {path}: {e}")
+            continue
+        yield from station_rows(data.get("results") or [], taken_at)
+
+
+def iter_rows(start=None, end=None, history_dir=None, recorded=True):
+    """
+    Historical station rows between two timestamps, oldest first
+    :param history_dir: Folder of the NDJSON history log, if any
+    :param recorded: Fall back to the recorded velib_data_*.json files when
+        there is no history log at all (not when it has nothing in the range)
+    """
+    logged = sorted(glob.glob(os.path.join(history_dir, "history_*.ndjson"))) if history_dir else []
+    if logged:
+        # One file per day: skip the days outside the range without opening them
+        files = []
+        for path in logged:
+            day = datetime.strptime(os.path.basename(path)[len("history_"):-len(".ndjson")], "%Y%m%d").timestamp()
+            if (end is None or day <= end) and (start is None or day + 86400 > start):
+                files.append(path)
+        return _history_rows(files, start, end)
+    # No history log: fall back to the recorded snapshot files
+    if not recorded:
+        return iter(())
+    files = sorted(recorded_snapshots(), key=os.path.basename)
+    return _recorded_rows(files, start, end)
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _encode_ndjson(rows, columns):
+    for batch in _batches(rows):
+        yield "".join(
+            json.dumps({column: row.get(column) for column in columns}, ensure_ascii=False) + "\n"
+            for row in batch
+        ).encode("utf-8")
+
+
+def _encode_csv(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in _batches(rows):
+        writer.writerows([row.get(column) for column in columns] for row in batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting what the parquet writer produces between batches"""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _encode_parquet(rows, columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column, getattr(pa, PARQUET_TYPES[column])()) for column in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    for batch in _batches(rows):
+        # One row group per batch, flushed to the response as soon as it is written
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {
+    "ndjson": _encode_ndjson,
+    "csv": _encode_csv,
+    "parquet": _encode_parquet,
+}
+
+
+def check_format(fmt):
+    """Raise ValueError if a format is unknown or its optional dependency is missing"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}', expected one of {', '.join(FORMATS)}")
+    if fmt == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ValueError("parquet export requires pyarrow (pip install pyarrow)")
+
+
+def export(rows, fmt="ndjson", columns=EXPORT_COLUMNS, compress=False):
+    """
+    Encode rows chunk by chunk
+    :param rows: Iterable of row dictionaries (see iter_rows)
+    :param fmt: ndjson, csv or parquet
+    :param columns: Columns to keep, in order
+    :param compress: Gzip the output on the fly
+    :return: Generator of bytes chunks
+    """
+    check_format(fmt)
+    chunks = ENCODERS[fmt](rows, columns)
+    if not compress:
+        yield from chunks
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
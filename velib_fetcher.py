@@ -1,12 +1,12 @@
-import requests
 import json
 from datetime import datetime
 import os
-from dotenv import load_dotenv
 import glob
+from velib_snapshot import fetch_all_records
+from velib_summary import SummaryEngine
 
-# Load environment variables
-load_dotenv()
+# requests and python-dotenv are imported on first use: they are slow to
+# import and the desktop app paints its window before touching the network
 
 class VelibFetcher:
     def __init__(self):
@@ -14,7 +14,18 @@ class VelibFetcher:
         self.base_url = "https://opendata.paris.fr/api/explore/v2.1/catalog/datasets/velib-disponibilite-en-temps-reel/records"
         # Additional endpoint for detailed bike information
         self.bikes_url = "https://opendata.paris.fr/api/explore/v2.1/catalog/datasets/velib-emplacement-des-stations/records"
-        self.api_key = os.getenv("VELIB_API_KEY")  # Optional API key
+        self._api_key = None
+        self._env_loaded = False
+
+    @property
+    def api_key(self):
+        """Optional API key, read from the environment/.env on first use"""
+        if not self._env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            self._api_key = os.getenv("VELIB_API_KEY")
+            self._env_loaded = True
+        return self._api_key
 
     def cleanup_old_files(self):
         """Delete old JSON files"""
@@ -27,27 +38,31 @@ class VelibFetcher:
         except Exception as e:
             print(f"Error cleaning up old files: {e}")
 
-    def get_stations(self, limit=100):
+    def get_stations(self, limit=None):
         """
         Fetch Velib stations data
-        :param limit: Number of stations to fetch
+        :param limit: Maximum number of stations to fetch, None for the whole network
         :return: List of stations with their data
         """
+        import requests
         try:
-            params = {
-                "limit": limit,
-                "select": "stationcode,name,capacity,ebike,mechanical,is_installed,is_renting,is_returning,coordonnees_geo"
-            }
-            
             headers = {}
             if self.api_key:
                 headers["Authorization"] = f"Bearer {self.api_key}"
 
+            def fetch_page(offset, page_limit):
+                params = {
+                    "limit": page_limit,
+                    "offset": offset,
+                    "select": "stationcode,name,capacity,ebike,mechanical,is_installed,is_renting,is_returning,coordonnees_geo"
+                }
+                response = requests.get(self.base_url, params=params, headers=headers, timeout=10)
+                response.raise_for_status()
+                return response.json()
+
             print("\n📡 Fetching Velib data...")
-            response = requests.get(self.base_url, params=params, headers=headers)
-            response.raise_for_status()
-            
-            data = response.json()
+            # The API caps a request at 100 records, page through the whole network
+            data = fetch_all_records(fetch_page, limit)
             
             # Generate individual bike information for each station
             print("Generating individual bike information...")
@@ -95,6 +110,7 @@ class VelibFetcher:
         we'll create bike entries based on the station's bike counts
         :return: Dictionary mapping station codes to their bikes
         """
+        import requests
         try:
             # Use the existing station data to create bike information
             # We'll get this data from the main stations call
@@ -194,16 +210,19 @@ def main():
     
     if data and "results" in data:
         stations = data["results"]
-        print(f"\n📊 Found {len(stations)} stations")
+        print(f"\n📊 Found {len(stations)} of {data.get('total_count', len(stations))} stations")
         
         # Calculate totals
-        total_ebikes = sum(station.get("ebike", 0) for station in stations)
-        total_mechanical = sum(station.get("mechanical", 0) for station in stations)
+        summary = SummaryEngine()
+        summary.update(stations)
+        totals = summary.network()
         
         print(f"\n📈 Summary:")
-        print(f"   Total e-bikes: {total_ebikes}")
-        print(f"   Total mechanical bikes: {total_mechanical}")
-        print(f"   Total bikes: {total_ebikes + total_mechanical}")
+        print(f"   Total e-bikes: {totals['ebike']}")
+        print(f"   Total mechanical bikes: {totals['mechanical']}")
+        print(f"   Total bikes: {totals['bikes']}")
+        print(f"   Occupancy: {totals['occupancy']:.0%}")
+        print(f"   Empty stations: {totals['empty']} | Full stations: {totals['full']}")
         
         # Save to file
         fetcher.save_to_json(data)
@@ -0,0 +1,191 @@
+"""
+Rental flows inferred from consecutive snapshots.
+
+The last e-bike and mechanical counts of every station are kept in flat
+arrays indexed by a row per station code. Each station of a new snapshot
+is diffed against its row as it is read: a drop in the e-bike or
+mechanical count is counted as pickups, a rise as returns. These are
+lower bounds, since a pickup and a return between two polls cancel out.
+
+Stations missing from a snapshot keep their last counts, so a caller
+that knows which stations changed (GBFS deltas) only passes those, and a
+poll then costs one pass over the changed stations. Flows are
+accumulated per station and for the whole network over a few rolling
+windows. Each poll only stores the stations that changed, and expired
+polls are subtracted again, so the cost follows the number of changes
+rather than the length of the window.
+"""
+from array import array
+from collections import deque
+import threading
+import time
+
+# Rolling windows, in seconds
+WINDOWS = {
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+    "24h": 24 * 60 * 60,
+}
+# Counters kept per station and window
+FLOWS = ("pickups_ebike", "returns_ebike", "pickups_mechanical", "returns_mechanical")
+# Polls further apart than this are not diffed, the counts are only used as a new baseline
+MAX_GAP = 15 * 60
+
+
+class _Window:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        # (timestamp, [(row, pickups_ebike, returns_ebike, pickups_mechanical, returns_mechanical), ...])
+        self.polls = deque()
+        # len(FLOWS) counters per station row
+        self.counters = array('i')
+        self.network = [0] * len(FLOWS)
+
+    def grow(self, rows):
+        missing = rows * len(FLOWS) - len(self.counters)
+        if missing > 0:
+            self.counters.extend(array('i', bytes(4 * missing)))
+
+    def _apply(self, changes, sign):
+        counters = self.counters
+        network = self.network
+        width = len(FLOWS)
+        for change in changes:
+            base = change[0] * width
+            for offset in range(width):
+                value = change[offset + 1]
+                if value:
+                    counters[base + offset] += sign * value
+                    network[offset] += sign * value
+
+    def add(self, timestamp, changes):
+        self.polls.append((timestamp, changes))
+        self._apply(changes, 1)
+        self.expire(timestamp)
+
+    def expire(self, now):
+        while self.polls and self.polls[0][0] <= now - self.seconds:
+            _, changes = self.polls.popleft()
+            self._apply(changes, -1)
+
+
+class FlowEngine:
+    def __init__(self, windows=WINDOWS):
+        # stationcode -> row in the arrays
+        self.rows = {}
+        self.codes = []
+        self.names = []
+        self.ebike = array('i')
+        self.mechanical = array('i')
+        self.last_poll = None
+        self.windows = {name: _Window(seconds) for name, seconds in windows.items()}
+        # Updates run in the refresh thread while requests read (and expire) the windows
+        self._lock = threading.Lock()
+
+    def memory_bytes(self):
+        """Rough size of the counters and of the polls kept for the windows"""
+        with self._lock:
+            size = 4 * (len(self.ebike) + len(self.mechanical))
+            for window in self.windows.values():
+                size += 4 * len(window.counters)
+                size += sum(100 + 80 * len(changes) for _, changes in window.polls)
+        return size
+
+    def update(self, stations, timestamp=None):
+        """
+        Diff a new snapshot against the previous counts
+        :param stations: List of station dictionaries, the whole network or only the changed stations
+        :param timestamp: When the snapshot was taken, defaults to now
+        :return: Number of stations with pickups or returns
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            return self._update(stations, timestamp)
+
+    def _update(self, stations, timestamp):
+        diffable = self.last_poll is not None and 0 < timestamp - self.last_poll <= MAX_GAP
+        rows = self.rows
+        ebike_counts = self.ebike
+        mechanical_counts = self.mechanical
+        changes = []
+        for station in stations:
+            code = station.get("stationcode")
+            if code is None:
+                continue
+            ebike = station.get("ebike") or 0
+            mechanical = station.get("mechanical") or 0
+            row = rows.get(code)
+            if row is None:
+                # New stations start with no delta
+                rows[code] = len(self.codes)
+                self.codes.append(code)
+                self.names.append(station.get("name"))
+                ebike_counts.append(ebike)
+                mechanical_counts.append(mechanical)
+                continue
+            de = ebike - ebike_counts[row]
+            dm = mechanical - mechanical_counts[row]
+            if not (de or dm):
+                continue
+            ebike_counts[row] = ebike
+            mechanical_counts[row] = mechanical
+            # After a long gap the counts are only a new baseline
+            if diffable:
+                changes.append((row, max(-de, 0), max(de, 0), max(-dm, 0), max(dm, 0)))
+
+        self.last_poll = timestamp
+        for window in self.windows.values():
+            window.grow(len(self.codes))
+            if diffable:
+                window.add(timestamp, changes)
+            else:
+                window.expire(timestamp)
+        return len(changes)
+
+    def flows(self, window="1h", limit=20, stationcode=None):
+        """
+        Pickups and returns over a rolling window
+        :param window: One of WINDOWS
+        :param limit: Number of busiest stations to include
+        :param stationcode: Only report this station
+        :raises ValueError: for an unknown window
+        """
+        if window not in self.windows:
+            raise ValueError(f"Unknown window '{window}', expected one of {', '.join(self.windows)}")
+        with self._lock:
+            return self._flows(window, limit, stationcode)
+
+    def _flows(self, window, limit, stationcode):
+        current = self.windows[window]
+        if self.last_poll is not None:
+            current.expire(self.last_poll)
+
+        width = len(FLOWS)
+        counters = current.counters
+        if stationcode is not None:
+            rows = [self.rows[stationcode]] if stationcode in self.rows else []
+        else:
+            activity = [sum(counters[row * width:(row + 1) * width]) for row in range(len(self.codes))]
+            rows = sorted((row for row in range(len(self.codes)) if activity[row]),
+                          key=activity.__getitem__, reverse=True)[:limit]
+
+        return {
+            "window": window,
+            "seconds": current.seconds,
+            "polls": len(current.polls),
+            "network": self._describe(current.network),
+            "stations": [
+                dict(self._describe(counters[row * width:(row + 1) * width]),
+                     stationcode=self.codes[row], name=self.names[row])
+                for row in rows
+            ],
+        }
+
+    @staticmethod
+    def _describe(values):
+        result = dict(zip(FLOWS, values))
+        result["pickups"] = result["pickups_ebike"] + result["pickups_mechanical"]
+        result["returns"] = result["returns_ebike"] + result["returns_mechanical"]
+        result["net"] = result["returns"] - result["pickups"]
+        return result
@@ -0,0 +1,204 @@
+"""
+Per-station availability forecasts.
+
+Every snapshot updates, for each station and each day-of-week/time-of-day
+bucket, exponentially weighted means and variances of the e-bike and
+mechanical counts and of their rates of change. Each update is constant
+time per station and the statistics live in flat float arrays indexed by
+(station row, bucket), so forecasts never need the raw history.
+"""
+from array import array
+from datetime import datetime
+import math
+import threading
+import time
+
+# Width of a time-of-day bucket, there are 7 days of them
+BUCKET_MINUTES = 60
+BUCKETS = 7 * 24 * 60 // BUCKET_MINUTES
+# Smoothing factor of the exponentially weighted statistics
+ALPHA = 0.2
+# Rates are only learned from consecutive polls closer than this
+MAX_RATE_GAP = 30 * 60
+# Horizon, in minutes, after which the bucket average counts as much as the current trend
+TREND_HALF_LIFE = 60
+
+KINDS = ("ebike", "mechanical")
+# Statistics kept per kind: count mean/variance and rate (bikes per minute) mean/variance
+FIELDS = ("mean", "var", "rate_mean", "rate_var")
+
+
+def bucket_of(timestamp):
+    """Day-of-week/time-of-day bucket of a unix timestamp (local time)"""
+    moment = datetime.fromtimestamp(timestamp)
+    minute_of_week = (moment.weekday() * 24 + moment.hour) * 60 + moment.minute
+    return minute_of_week // BUCKET_MINUTES
+
+
+def _ewm(means, variances, index, value, first):
+    """Exponentially weighted mean/variance update of one cell"""
+    if first:
+        means[index] = value
+        variances[index] = 0.0
+        return
+    diff = value - means[index]
+    increment = ALPHA * diff
+    means[index] += increment
+    variances[index] = (1 - ALPHA) * (variances[index] + diff * increment)
+
+
+def _empty_probability(mean, variance):
+    """
+    Probability that a count with this mean and variance is zero, from a
+    distribution of non negative counts with the same moments: negative
+    binomial when the count varies more than its mean, Poisson when as
+    much, binomial when less
+    """
+    if mean <= 0:
+        return 1.0
+    # A count with a fractional mean cannot have less variance than this
+    fraction = mean - math.floor(mean)
+    variance = max(variance, fraction * (1 - fraction))
+    if math.isclose(variance, mean, rel_tol=1e-6):
+        return math.exp(-mean)
+    if variance > mean:
+        p = mean / variance
+        return p ** (mean * p / (1 - p))
+    if variance <= 0:
+        return 0.0
+    p = 1 - variance / mean
+    return (variance / mean) ** (mean / p)
+
+
+class ForecastEngine:
+    def __init__(self):
+        # stationcode -> row in the statistics arrays
+        self.rows = {}
+        # Last observation of each station: counts and time
+        self.last_ebike = array('i')
+        self.last_mechanical = array('i')
+        self.last_seen = array('d')
+        # kind -> field -> float array of len(rows) * BUCKETS
+        self.stats = {kind: {field: array('f') for field in FIELDS} for kind in KINDS}
+        # Observations per (row, bucket) for levels and for rates, saturating
+        self.level_count = array('H')
+        self.rate_count = array('H')
+        # Updates run in the refresh thread while requests read forecasts
+        self._lock = threading.Lock()
+
+    def _add_row(self, code):
+        row = len(self.rows)
+        self.last_ebike.append(0)
+        self.last_mechanical.append(0)
+        self.last_seen.append(0.0)
+        zeros = array('f', bytes(4 * BUCKETS))
+        for fields in self.stats.values():
+            for values in fields.values():
+                values.extend(zeros)
+        self.level_count.extend(array('H', bytes(2 * BUCKETS)))
+        self.rate_count.extend(array('H', bytes(2 * BUCKETS)))
+        # Only published once its arrays exist
+        self.rows[code] = row
+        return row
+
+    def memory_bytes(self):
+        """Size of the statistics arrays"""
+        arrays = [self.last_ebike, self.last_mechanical, self.last_seen, self.level_count, self.rate_count]
+        arrays.extend(values for fields in self.stats.values() for values in fields.values())
+        return sum(values.itemsize * len(values) for values in arrays)
+
+    def update(self, stations, timestamp=None):
+        """
+        Learn from a new snapshot
+        :param stations: List of station dictionaries
+        :param timestamp: When the snapshot was taken, defaults to now
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            self._update(stations, timestamp)
+
+    def _update(self, stations, timestamp):
+        bucket = bucket_of(timestamp)
+        for station in stations:
+            code = station.get("stationcode")
+            if code is None:
+                continue
+            row = self.rows.get(code)
+            if row is None:
+                row = self._add_row(code)
+            index = row * BUCKETS + bucket
+            counts = {"ebike": station.get("ebike") or 0, "mechanical": station.get("mechanical") or 0}
+            previous = {"ebike": self.last_ebike[row], "mechanical": self.last_mechanical[row]}
+            gap = timestamp - self.last_seen[row]
+            has_rate = self.last_seen[row] > 0 and 0 < gap <= MAX_RATE_GAP
+
+            first_level = self.level_count[index] == 0
+            first_rate = self.rate_count[index] == 0
+            for kind in KINDS:
+                stats = self.stats[kind]
+                _ewm(stats["mean"], stats["var"], index, counts[kind], first_level)
+                if has_rate:
+                    rate = (counts[kind] - previous[kind]) / (gap / 60)
+                    _ewm(stats["rate_mean"], stats["rate_var"], index, rate, first_rate)
+
+            if self.level_count[index] < 0xFFFF:
+                self.level_count[index] += 1
+            if has_rate and self.rate_count[index] < 0xFFFF:
+                self.rate_count[index] += 1
+            self.last_ebike[row] = counts["ebike"]
+            self.last_mechanical[row] = counts["mechanical"]
+            self.last_seen[row] = timestamp
+
+    def forecast(self, code, minutes=15, now=None):
+        """
+        Expected bike counts at a station a few minutes from now
+        :param code: Station code
+        :param minutes: Forecast horizon
+        :param now: Reference time, defaults to now
+        :return: Forecast dictionary, or None for an unknown station
+        """
+        with self._lock:
+            return self._forecast(code, minutes, now)
+
+    def _forecast(self, code, minutes, now):
+        row = self.rows.get(code)
+        if row is None:
+            return None
+        if now is None:
+            now = time.time()
+        current = row * BUCKETS + bucket_of(now)
+        target = row * BUCKETS + bucket_of(now + minutes * 60)
+        # The further ahead, the more the usual level of the target bucket matters
+        weight = minutes / (minutes + TREND_HALF_LIFE) if self.level_count[target] else 0.0
+        has_rate = self.rate_count[current] > 0
+        last = {"ebike": self.last_ebike[row], "mechanical": self.last_mechanical[row]}
+
+        result = {
+            "stationcode": code,
+            "minutes": minutes,
+            "observed_at": self.last_seen[row],
+            "observations": self.level_count[current],
+        }
+        total_mean = total_var = 0.0
+        for kind in KINDS:
+            stats = self.stats[kind]
+            rate = stats["rate_mean"][current] if has_rate else 0.0
+            rate_var = stats["rate_var"][current] if has_rate else 0.0
+            trend_mean = max(last[kind] + rate * minutes, 0.0)
+            trend_var = rate_var * minutes * minutes
+            mean = (1 - weight) * trend_mean + weight * stats["mean"][target]
+            variance = (1 - weight) * trend_var + weight * stats["var"][target]
+            total_mean += mean
+            total_var += variance
+            result[kind] = {
+                "current": last[kind],
+                "expected": round(mean, 2),
+                "empty_risk": round(_empty_probability(mean, variance), 3),
+            }
+        result["total"] = {
+            "current": last["ebike"] + last["mechanical"],
+            "expected": round(total_mean, 2),
+            "empty_risk": round(_empty_probability(total_mean, total_var), 3),
+        }
+        return result
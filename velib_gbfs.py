@@ -0,0 +1,191 @@
+"""
+GBFS data source.
+
+Reads the standard GBFS feeds instead of the Paris Opendata records API
+and returns the same {"results": [...]} structure as VelibFetcher:
+
+- station_status is only downloaded again once its advertised ttl has
+  expired, otherwise the previous result is returned as is;
+- stations whose last_reported did not change are not processed again,
+  their previous dictionaries are reused, and `delta` lists the stations
+  that changed so consumers can update in proportion to the changes;
+- station_information (names, positions, capacities) is kept in a
+  long-lived cache and only refreshed once a day or when an unknown
+  station shows up. Stations still unknown after that refresh (feeds
+  often list a few) are remembered and only retried with the daily one.
+"""
+import os
+import time
+
+from velib_snapshot import generate_bikes
+
+# Velib Metropole GBFS auto-discovery feed
+VELIB_GBFS_URL = "https://velib-metropole-opendata.smovengo.cloud/opendata/Velib_Metropole/gbfs.json"
+# Maximum age of the cached station_information feed, in seconds
+INFORMATION_MAX_AGE = 24 * 60 * 60
+# Bounds applied to the ttl advertised by the feed
+MIN_TTL = 5
+MAX_TTL = 300
+
+
+def _flag(value):
+    """GBFS booleans (0/1 or true/false) to the OUI/NON of the Opendata API"""
+    return "OUI" if value in (1, True, "1", "true") else "NON"
+
+
+def _bike_types(status):
+    """E-bike and mechanical counts of a station_status entry"""
+    types = status.get("num_bikes_available_types")
+    ebike = mechanical = None
+    # Velib publishes a list of single key dictionaries, other systems a plain dictionary
+    if isinstance(types, list):
+        types = {key: value for entry in types if isinstance(entry, dict) for key, value in entry.items()}
+    if isinstance(types, dict):
+        ebike = types.get("ebike")
+        mechanical = types.get("mechanical")
+    if ebike is None and mechanical is None:
+        return 0, status.get("num_bikes_available") or 0
+    return ebike or 0, mechanical or 0
+
+
+class GBFSFetcher:
+    def __init__(self, gbfs_url=None, language="en", user_agent="VelibStationFinder/1.0"):
+        self.gbfs_url = gbfs_url or os.environ.get("VELIB_GBFS_URL", VELIB_GBFS_URL)
+        self.language = language
+        self.headers = {"User-Agent": user_agent}
+        self.feeds = None
+        # station_id -> station_information entry
+        self.information = {}
+        self.information_fetched_at = 0.0
+        # station_ids of station_status missing from station_information after a refresh
+        self.missing_information = set()
+        # station_id -> (last_reported, station dictionary in Opendata format)
+        self._stations = {}
+        self._data = None
+        self.last_updated = None
+        self.next_refresh = 0.0
+        self.last_changed = 0
+        # Difference between the last result and the one before it:
+        # {"since": previous results list, "changed": [station, ...], "removed": [stationcode, ...]},
+        # None when every station was rebuilt
+        self.delta = None
+
+    def _get(self, url):
+        import requests
+        response = requests.get(url, headers=self.headers, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    def _feed_url(self, name):
+        if self.feeds is None:
+            discovery = self._get(self.gbfs_url).get("data", {})
+            # Feeds are listed per language, fall back to the first one published
+            language = discovery.get(self.language) or next(iter(discovery.values()), {})
+            self.feeds = {feed["name"]: feed["url"] for feed in language.get("feeds", [])}
+        if name not in self.feeds:
+            raise KeyError(f"GBFS feed '{name}' not published by {self.gbfs_url}")
+        return self.feeds[name]
+
+    def _refresh_information(self):
+        feed = self._get(self._feed_url("station_information"))
+        self.information = {
+            str(station["station_id"]): station
+            for station in feed.get("data", {}).get("stations", [])
+        }
+        self.information_fetched_at = time.time()
+        # Names/positions may have changed: rebuild every station next time
+        self._stations.clear()
+
+    def seconds_until_refresh(self):
+        """Seconds until the advertised ttl of station_status expires, 0 if it already has"""
+        return max(self.next_refresh - time.time(), 0.0)
+
+    def _convert(self, station_id, status, info):
+        code = str(status.get("stationCode") or info.get("stationCode") or station_id)
+        ebike, mechanical = _bike_types(status)
+        return {
+            "stationcode": code,
+            "name": info.get("name"),
+            "capacity": info.get("capacity") or (
+                (status.get("num_bikes_available") or 0) + (status.get("num_docks_available") or 0)
+            ),
+            "ebike": ebike,
+            "mechanical": mechanical,
+            "is_installed": _flag(status.get("is_installed")),
+            "is_renting": _flag(status.get("is_renting")),
+            "is_returning": _flag(status.get("is_returning")),
+            "coordonnees_geo": {"lon": info.get("lon"), "lat": info.get("lat")},
+            "last_reported": status.get("last_reported"),
+            "bikes": generate_bikes(code, ebike, mechanical),
+        }
+
+    def get_stations(self, limit=None):
+        """
+        Fetch station data, at most once per feed ttl
+        :param limit: Optional maximum number of stations returned
+        :return: {"total_count", "results"} like VelibFetcher.get_stations, the
+                 previous result itself if the feed did not change, None on failure
+        """
+        if self._data is not None and time.time() < self.next_refresh:
+            return self._limited(limit)
+        try:
+            refreshed = not self.information or time.time() - self.information_fetched_at > INFORMATION_MAX_AGE
+            if refreshed:
+                self._refresh_information()
+            feed = self._get(self._feed_url("station_status"))
+            # ttl 0 is legitimate (always refresh), only a missing ttl gets the default
+            ttl = feed.get("ttl")
+            ttl = min(max(60 if ttl is None else ttl, MIN_TTL), MAX_TTL)
+            self.next_refresh = time.time() + ttl
+
+            last_updated = feed.get("last_updated")
+            if self._data is not None and last_updated == self.last_updated:
+                self.last_changed = 0
+                return self._limited(limit)
+
+            statuses = feed.get("data", {}).get("stations", [])
+            unknown = {str(status.get("station_id")) for status in statuses} - self.information.keys()
+            # Not again if it was just downloaded
+            if unknown - self.missing_information and not refreshed:
+                self._refresh_information()
+                unknown -= self.information.keys()
+            self.missing_information = unknown
+
+            # After an information refresh every station is rebuilt, there is no delta
+            incremental = bool(self._stations) and self._data is not None
+            changed = []
+            results = []
+            stations = {}
+            for status in statuses:
+                station_id = str(status.get("station_id"))
+                reported = status.get("last_reported")
+                previous = self._stations.get(station_id)
+                if previous is not None and previous[0] == reported:
+                    station = previous[1]
+                else:
+                    station = self._convert(station_id, status, self.information.get(station_id, {}))
+                    changed.append(station)
+                stations[station_id] = (reported, station)
+                results.append(station)
+
+            self.delta = {
+                "since": self._data["results"],
+                "changed": changed,
+                "removed": [self._stations[station_id][1]["stationcode"]
+                            for station_id in self._stations.keys() - stations.keys()],
+            } if incremental else None
+            self._stations = stations
+            self.last_changed = len(changed)
+            self._data = {"total_count": len(results), "results": results}
+            # Only now: a feed that failed half way is not taken for the applied one
+            self.last_updated = last_updated
+            return self._limited(limit)
+        except Exception as e:
+            print(f"❌ Error fetching GBFS data: {e}")
+            self.next_refresh = time.time() + MIN_TTL
+            return self._data
+
+    def _limited(self, limit):
+        if limit is None or self._data is None or limit >= len(self._data["results"]):
+            return self._data
+        return {"total_count": self._data["total_count"], "results": self._data["results"][:limit]}
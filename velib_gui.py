@@ -1,7 +1,19 @@
+import time
+
+# Start of the cold start measurement, taken before the heavier imports
+_START_TIME = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, messagebox
 from velib_fetcher import VelibFetcher
+from velib_gbfs import GBFSFetcher
+from velib_summary import SummaryEngine
+from velib_snapshot import load_last_snapshot, save_last_snapshot
 import json
+import os
+import queue
+import sys
+import threading
 from datetime import datetime
 
 class VelibApp:
@@ -13,9 +25,15 @@ class VelibApp:
         # Configure dark theme colors
         self.setup_dark_theme()
         
-        # Initialize the fetcher
-        self.fetcher = VelibFetcher()
+        # Initialize the fetcher (VELIB_SOURCE=gbfs reads the GBFS feeds instead)
+        self.fetcher = GBFSFetcher() if os.environ.get("VELIB_SOURCE") == "gbfs" else VelibFetcher()
+        self.summary = SummaryEngine()
         self.stations_data = None
+        self.stale_since = None
+        
+        # Background fetches hand their result back to the Tk thread through this queue
+        self._fetch_results = queue.Queue()
+        self._fetching = False
         
         # Create the main frame
         self.main_frame = ttk.Frame(root, padding="10", style='Dark.TFrame')
@@ -27,6 +45,9 @@ class VelibApp:
         # Create the results frame
         self.create_results_frame()
         
+        # Create the network summary panel
+        self.create_summary_frame()
+        
         # Create the status bar
         self.status_var = tk.StringVar()
         self.status_bar = ttk.Label(root, textvariable=self.status_var, relief=tk.SUNKEN, style='Dark.TLabel')
@@ -37,7 +58,8 @@ class VelibApp:
         self.style.configure("Treeview", rowheight=28, font=('Segoe UI', 10))
         self.style.configure("Treeview.Heading", font=('Segoe UI', 10, 'bold'))
         
-        # Initial fetch
+        # Paint from the last snapshot on disk, then refresh in the background
+        self.load_cached_snapshot()
         self.fetch_data()
 
     def setup_dark_theme(self):
@@ -118,6 +140,11 @@ class VelibApp:
         style.configure('Dark.TLabel',
                        background=self.colors['bg_light'],
                        foreground=self.colors['text_primary'])
+        
+        # Status bar while showing saved (stale) data
+        style.configure('Stale.TLabel',
+                       background=self.colors['bg_light'],
+                       foreground=self.colors['accent_orange'])
 
     def create_search_frame(self):
         search_frame = ttk.LabelFrame(self.main_frame, text="Search", padding="5", style='Dark.TLabelframe')
@@ -173,15 +200,100 @@ class VelibApp:
         self.tree.tag_configure('active', foreground=self.colors['accent_green'])
         self.tree.tag_configure('inactive', foreground=self.colors['accent_red'])
 
+    def create_summary_frame(self):
+        summary_frame = ttk.LabelFrame(self.main_frame, text="Network Summary", padding="5", style='Dark.TLabelframe')
+        summary_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+        
+        # Network wide totals
+        self.summary_var = tk.StringVar(value="No data yet")
+        ttk.Label(summary_frame, textvariable=self.summary_var, style='Dark.TLabel').grid(row=0, column=0, sticky=tk.W, padx=5)
+        
+        # Busiest arrondissements/communes
+        self.districts_var = tk.StringVar()
+        ttk.Label(summary_frame, textvariable=self.districts_var, style='Dark.TLabel').grid(row=1, column=0, sticky=tk.W, padx=5)
+
+    def update_summary_panel(self):
+        totals = self.summary.network()
+        self.summary_var.set(
+            f"Stations: {totals['stations']} | E-Bikes: {totals['ebike']} | Mechanical: {totals['mechanical']} | "
+            f"Free docks: {totals['docks']} | Occupancy: {totals['occupancy']:.0%} | "
+            f"Empty: {totals['empty']} | Full: {totals['full']}"
+        )
+        
+        # Show the districts with the most available bikes
+        districts = sorted(
+            self.summary.districts.items(),
+            key=lambda item: item[1]["ebike"] + item[1]["mechanical"],
+            reverse=True
+        )[:5]
+        self.districts_var.set("Most bikes: " + ", ".join(
+            f"{name} ({counters['ebike'] + counters['mechanical']})" for name, counters in districts
+        ))
+
+    def load_cached_snapshot(self):
+        """Show the last persisted snapshot, marked as stale, until fresh data arrives"""
+        data, saved_at = load_last_snapshot()
+        if not data:
+            return
+        self.stations_data = data["results"]
+        self.summary.update(self.stations_data)
+        self.update_station_list()
+        self.update_summary_panel()
+        self.stale_since = saved_at
+        self.status_bar.configure(style='Stale.TLabel')
+        self.status_var.set(f"{self.stale_message()} - refreshing...")
+
+    def stale_message(self):
+        saved_at = datetime.fromtimestamp(self.stale_since).strftime('%d/%m %H:%M')
+        return f"Showing saved data from {saved_at} (stale)"
+
     def fetch_data(self):
-        self.status_var.set("Fetching data...")
-        self.root.update()
+        if self._fetching:
+            return
+        self._fetching = True
+        if self.stale_since is None:
+            self.status_var.set("Fetching data...")
+        
+        threading.Thread(target=self._fetch_worker, daemon=True).start()
+        self.root.after(100, self._check_fetch)
+
+    def _fetch_worker(self):
+        """Runs in a background thread: fetch and persist, never touch Tk here"""
+        data = None
+        try:
+            data = self.fetcher.get_stations()
+            if data and "results" in data:
+                try:
+                    save_last_snapshot(data)
+                except Exception as e:
+                    # The fresh data is still shown, it just will not be the next warm start
+                    print(f"Error saving snapshot cache: {e}")
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            data = None
+        finally:
+            # Always answer, or _check_fetch polls forever and Refresh stays disabled
+            self._fetch_results.put(data)
+
+    def _check_fetch(self):
+        try:
+            data = self._fetch_results.get_nowait()
+        except queue.Empty:
+            self.root.after(100, self._check_fetch)
+            return
         
-        data = self.fetcher.get_stations()
+        self._fetching = False
         if data and "results" in data:
             self.stations_data = data["results"]
+            self.summary.update(self.stations_data)
             self.update_station_list()
+            self.update_summary_panel()
+            self.stale_since = None
+            self.status_bar.configure(style='Dark.TLabel')
             self.status_var.set(f"Data updated at {datetime.now().strftime('%H:%M:%S')}")
+        elif self.stale_since is not None:
+            # Keep the saved data on screen rather than an empty window
+            self.status_var.set(f"{self.stale_message()} - failed to refresh")
         else:
             messagebox.showerror("Error", "Failed to fetch data from Velib API")
             self.status_var.set("Error fetching data")
@@ -192,8 +304,8 @@ class VelibApp:
             self.tree.delete(item)
         
         # If no stations provided, use all stations
-        if stations is None and self.stations_data:
-            stations = self.stations_data
+        if stations is None:
+            stations = self.stations_data or []
         
         # Add stations to the treeview
         for station in stations:
@@ -401,6 +513,16 @@ class VelibApp:
 def main():
     root = tk.Tk()
     app = VelibApp(root)
+    
+    # Report the cold start time, once the window has actually been drawn
+    root.update()
+    startup_ms = (time.perf_counter() - _START_TIME) * 1000
+    print(f"⏱️ Window ready in {startup_ms:.0f} ms")
+    
+    # --startup-time: only measure the cold start, then quit
+    if "--startup-time" in sys.argv:
+        root.destroy()
+        return
     root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,454 @@
+"""
+Load generator and latency report for the Flask API.
+
+Starts web/api/app.py against a local replay of a recorded snapshot (no
+upstream traffic), drives a weighted mix of station list, search and
+detail requests, and writes a JSON report with throughput, latency
+percentiles, error rate and server CPU/RSS that later runs can be
+compared against.
+
+    python velib_loadtest.py --mode closed --concurrency 16 --duration 30
+    python velib_loadtest.py --mode open --rate 200 --compare loadtest_previous.json
+    python velib_loadtest.py --cold-start --duration 5
+"""
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote
+
+from velib_snapshot import recorded_snapshots
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(ROOT_DIR, "web", "api", "app.py")
+DEFAULT_MIX = "stations=4,search=3,detail=3"
+
+
+def parse_mix(value):
+    """Parse "stations=4,search=3,detail=3" into {endpoint: weight}"""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint '{name}', expected some of {', '.join(ENDPOINTS)}")
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid weight '{weight}' for {name}")
+    return mix
+
+
+class RequestFactory:
+    """Builds request paths from the stations of the replayed snapshot"""
+    def __init__(self, stations, mix, seed=None):
+        self.random = random.Random(seed)
+        self.codes = [station["stationcode"] for station in stations if station.get("stationcode")]
+        self.words = sorted({
+            word.lower() for station in stations
+            for word in (station.get("name") or "").split() if len(word) > 3
+        }) or ["gare"]
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+
+    def next(self):
+        name = self.random.choices(self.names, self.weights)[0]
+        return name, ENDPOINTS[name](self)
+
+
+ENDPOINTS = {
+    "stations": lambda factory: "/api/stations",
+    "search": lambda factory: f"/api/stations/search/{quote(factory.random.choice(factory.words))}",
+    "detail": lambda factory: f"/api/stations/{factory.random.choice(factory.codes)}",
+    "summary": lambda factory: "/api/summary",
+    "forecast": lambda factory: f"/api/stations/{factory.random.choice(factory.codes)}/forecast",
+    "flows": lambda factory: "/api/flows",
+}
+
+
+def get_json(host, port, path, timeout):
+    """GET a JSON document, None on any error"""
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request("GET", path)
+        return json.loads(connection.getresponse().read())
+    except (OSError, ValueError, http.client.HTTPException):
+        return None
+    finally:
+        connection.close()
+
+
+def send(host, port, path, timeout):
+    """Send one GET, return (status or None, error message or None)"""
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        return response.status, None
+    except (OSError, http.client.HTTPException) as e:
+        return None, str(e)
+    finally:
+        connection.close()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = []
+        self._lock = threading.Lock()
+
+    def record(self, name, latency, status, error):
+        with self._lock:
+            self.latencies[name].append(latency)
+            if error is not None or not 200 <= status < 400:
+                self.errors[name] += 1
+                if len(self.error_samples) < 10:
+                    self.error_samples.append(error or f"HTTP {status} on {name}")
+
+
+def run_closed(host, port, factory, concurrency, duration, timeout, recorder):
+    """Each worker sends its next request as soon as the previous one completes"""
+    deadline = time.perf_counter() + duration
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                name, path = factory.next()
+            start = time.perf_counter()
+            if start >= deadline:
+                return
+            status, error = send(host, port, path, timeout)
+            recorder.record(name, time.perf_counter() - start, status, error)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open(host, port, factory, concurrency, duration, rate, timeout, recorder):
+    """
+    Requests are sent on a fixed schedule whatever the response times.
+    Latency is measured from the scheduled time, so a saturated server
+    shows up as queueing delay instead of a slower request rate.
+    """
+    def task(name, path, scheduled):
+        status, error = send(host, port, path, timeout)
+        recorder.record(name, time.perf_counter() - scheduled, status, error)
+
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        sent = 0
+        while True:
+            scheduled = start + sent * interval
+            if scheduled - start >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            name, path = factory.next()
+            pool.submit(task, name, path, scheduled)
+            sent += 1
+
+
+def _process_usage(pid):
+    """(cpu seconds, rss bytes) of a process, None if it cannot be read"""
+    try:
+        import psutil
+        process = psutil.Process(pid)
+        times = process.cpu_times()
+        return times.user + times.system, process.memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    # Linux without psutil
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpu = (int(fields[11]) + int(fields[12])) / ticks
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+        return cpu, rss
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+
+
+class ServerMonitor:
+    """Samples the server RSS while the load runs, and its CPU time over the run"""
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.max_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            usage = _process_usage(self.pid)
+            if usage:
+                self.max_rss = max(self.max_rss, usage[1])
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start_usage = _process_usage(self.pid)
+        self.start_time = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        end_usage = _process_usage(self.pid)
+        elapsed = time.perf_counter() - self.start_time
+        if self.start_usage and end_usage:
+            self.cpu_seconds = end_usage[0] - self.start_usage[0]
+            self.max_rss = max(self.max_rss, end_usage[1])
+        else:
+            self.cpu_seconds = None
+        self.cpu_percent = round(100 * self.cpu_seconds / elapsed, 1) if self.cpu_seconds is not None else None
+
+
+class _NoMonitor:
+    """Stand-in when the server process is unknown"""
+    cpu_percent = None
+    max_rss = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def timed_get(host, port, path, timeout):
+    """
+    Send one GET and time it
+    :return: (status or None, seconds until the body was read, Server-Timing header or None)
+    """
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    start = time.perf_counter()
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - start, response.getheader("Server-Timing")
+    except (OSError, http.client.HTTPException):
+        return None, time.perf_counter() - start, None
+    finally:
+        connection.close()
+
+
+def start_server(port, replay_file, cold_start=False):
+    """
+    Start the Flask app on a recorded snapshot and wait until it accepts connections
+    :param cold_start: Run the app in its serverless cold start mode
+    :return: (server process, seconds until its port was open)
+    """
+    env = dict(os.environ, PORT=str(port), FLASK_DEBUG="0", VELIB_REPLAY_FILE=os.path.abspath(replay_file))
+    if cold_start:
+        env["VELIB_COLD_START"] = "1"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, APP_PATH], env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        # A TCP connect only: the first HTTP request the app serves is the measured one
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server, time.perf_counter() - started
+        except OSError:
+            time.sleep(0.05)
+    server.terminate()
+    raise RuntimeError("Server did not start within 30 seconds")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    rank = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def _latency_stats(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    to_ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        "requests": len(ordered),
+        "throughput": round(len(ordered) / elapsed, 1) if elapsed else 0,
+        "error_rate": round(errors / len(ordered), 4) if ordered else 0,
+        "p50_ms": to_ms(percentile(ordered, 0.50)),
+        "p95_ms": to_ms(percentile(ordered, 0.95)),
+        "p99_ms": to_ms(percentile(ordered, 0.99)),
+        "max_ms": to_ms(ordered[-1] if ordered else None),
+    }
+
+
+def build_report(args, recorder, elapsed, monitor, cold_start=None):
+    all_latencies = [value for values in recorder.latencies.values() for value in values]
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "mode": args.mode,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "rate": args.rate if args.mode == "open" else None,
+            "mix": args.mix,
+            "target": args.url or "local replay",
+            "replay_file": None if args.url else os.path.basename(args.replay),
+        },
+        "elapsed": round(elapsed, 2),
+        "overall": _latency_stats(all_latencies, sum(recorder.errors.values()), elapsed),
+        "endpoints": {
+            name: _latency_stats(values, recorder.errors[name], elapsed)
+            for name, values in sorted(recorder.latencies.items())
+        },
+        "server": {
+            "cpu_percent": monitor.cpu_percent,
+            "max_rss_mb": round(monitor.max_rss / 2 ** 20, 1) if monitor.max_rss else None,
+        },
+        "cold_start": cold_start,
+        "error_samples": recorder.error_samples,
+    }
+    return report
+
+
+def compare(report, baseline):
+    """Print the change of the main figures against a previous report"""
+    print(f"\n📊 Compared to {baseline.get('created_at', 'baseline')}:")
+    for key in ("throughput", "p50_ms", "p95_ms", "p99_ms", "max_ms", "error_rate"):
+        old = baseline.get("overall", {}).get(key)
+        new = report["overall"].get(key)
+        if old in (None, 0) or new is None:
+            print(f"   {key}: {old} -> {new}")
+        else:
+            print(f"   {key}: {old} -> {new} ({(new - old) / old:+.1%})")
+
+
+def print_report(report):
+    overall = report["overall"]
+    print(f"\n📈 {overall['requests']} requests in {report['elapsed']} s ({report['config']['mode']} loop)")
+    print(f"   Throughput: {overall['throughput']} req/s | Errors: {overall['error_rate']:.2%}")
+    print(f"   Latency p50/p95/p99/max: {overall['p50_ms']} / {overall['p95_ms']} / {overall['p99_ms']} / {overall['max_ms']} ms")
+    for name, stats in report["endpoints"].items():
+        print(f"   {name:>9}: {stats['requests']} req, p50 {stats['p50_ms']} ms, p99 {stats['p99_ms']} ms")
+    server = report["server"]
+    print(f"   Server CPU: {server['cpu_percent']}% | Max RSS: {server['max_rss_mb']} MB")
+    cold_start = report.get("cold_start")
+    if cold_start:
+        print(f"   Cold start: listening after {cold_start['startup_ms']} ms (app import {cold_start.get('import_ms')} ms), "
+              f"first /api/stations in {cold_start['first_stations_ms']} ms "
+              f"(server side {cold_start.get('first_request_ms')} ms after start)")
+
+
+def main(argv=None):
+    snapshots = recorded_snapshots()
+    parser = argparse.ArgumentParser(description="Load test the Velib Station Finder API")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed",
+                        help="closed: workers wait for each response; open: fixed request rate")
+    parser.add_argument("--concurrency", type=int, default=8, help="Workers (closed) or maximum in-flight requests (open)")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of load")
+    parser.add_argument("--rate", type=float, default=100, help="Requests per second in open loop mode")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Weighted endpoint mix, default {DEFAULT_MIX}")
+    parser.add_argument("--replay", default=snapshots[0] if snapshots else None,
+                        help="Recorded snapshot served by the app, defaults to the newest velib_data_*.json")
+    parser.add_argument("--url", help="Target an already running server (http://host:port) instead of starting one")
+    parser.add_argument("--cold-start", action="store_true",
+                        help="Start the app in its serverless mode (bundled snapshot, background refresh)")
+    parser.add_argument("--server-pid", type=int, help="PID of the --url server, for CPU/RSS figures")
+    parser.add_argument("--timeout", type=float, default=10, help="Per request timeout in seconds")
+    parser.add_argument("--seed", type=int, help="Seed of the request mix")
+    parser.add_argument("--output", help="Report file, defaults to loadtest_<timestamp>.json")
+    parser.add_argument("--compare", help="Previous report to compare against")
+    args = parser.parse_args(argv)
+
+    if not args.replay:
+        parser.error("no velib_data_*.json snapshot found, pass --replay")
+    with open(args.replay, "r", encoding="utf-8") as f:
+        stations = json.load(f).get("results") or []
+    factory = RequestFactory(stations, args.mix, args.seed)
+
+    server = None
+    if args.url:
+        target = args.url.split("://", 1)[-1].rstrip("/")
+        host, _, port = target.partition(":")
+        port = int(port or 80)
+        pid = args.server_pid
+    else:
+        host, port = "127.0.0.1", _free_port()
+        print(f"🚀 Starting the app on port {port} with {os.path.basename(args.replay)}...")
+        server, startup = start_server(port, args.replay, args.cold_start)
+        pid = server.pid
+
+    cold_start = None
+    try:
+        # Warm up: first snapshot load and lazy imports should not count, but are reported.
+        # On a started server this is its very first request, /test is only asked afterwards
+        status, first_stations, server_timing = timed_get(host, port, "/api/stations", args.timeout)
+        if server is not None:
+            info = get_json(host, port, "/test", args.timeout) or {}
+            cold_start = dict(
+                info.get("cold_start") or {},
+                startup_ms=round(1000 * startup, 1),
+                first_stations_status=status,
+                first_stations_ms=round(1000 * first_stations, 1),
+                first_stations_server_timing=server_timing
+            )
+        send(host, port, "/api/summary", args.timeout)
+
+        recorder = Recorder()
+        print(f"🔥 Running {args.mode} loop load for {args.duration:g} s...")
+        with ServerMonitor(pid) if pid else _NoMonitor() as monitor:
+            start = time.perf_counter()
+            if args.mode == "closed":
+                run_closed(host, port, factory, args.concurrency, args.duration, args.timeout, recorder)
+            else:
+                run_open(host, port, factory, args.concurrency, args.duration, args.rate, args.timeout, recorder)
+            elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = build_report(args, recorder, elapsed, monitor, cold_start)
+    print_report(report)
+    output = args.output or f"loadtest_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Report saved to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Registry of bike-share systems served by one process.
+
+Each named system has its own fetcher, refresh schedule, snapshot cache,
+search index, spatial index and engines, behind its own lock, so a slow
+or busy city never blocks requests to another one. A system only talks
+to its upstream when it is queried and its snapshot is older than its
+ttl, so idle cities cost no upstream traffic.
+
+Memory is bounded twice: a system going over its own budget drops its
+forecast statistics (the largest structure), and when all loaded systems
+together go over the registry budget the least recently queried ones are
+unloaded. An unloaded system is rebuilt from upstream on its next query;
+its watches are kept.
+
+With background_refresh a system that already has data never makes a
+request wait for upstream: a stale snapshot is served while one thread
+fetches the next one. Serverless deployments seed their systems with a
+bundled snapshot so even the first request after a cold start is
+answered without an upstream round trip.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+from velib_alerts import AlertEngine, BroadcastSink, QueueSink, WebhookSink
+from velib_export import append_history
+from velib_flows import FlowEngine
+from velib_forecast import ForecastEngine
+from velib_search import SearchIndex
+from velib_summary import SummaryEngine
+from velib_trip import TripPlanner
+
+# Rough size of one station dictionary, bikes list included
+STATION_BYTES = 2048
+# First path segments already used by the un-namespaced routes
+RESERVED_NAMES = {"stations", "summary", "trip", "flows", "export", "watches", "alerts"}
+
+# One delivery thread for the webhooks of every system
+_webhooks = WebhookSink()
+
+
+class StationSystem:
+    def __init__(self, name, fetcher_factory, ttl=60, history_dir=None, recorded_history=False,
+                 memory_budget=64 * 2 ** 20, background_refresh=False):
+        """
+        :param fetcher_factory: Callable returning a fetcher with a get_stations() method
+        :param ttl: Seconds a snapshot is reused before asking upstream again, for
+            fetchers that do not schedule their own refreshes (seconds_until_refresh)
+        :param history_dir: Folder of the NDJSON history log of this system, if any
+        :param recorded_history: Export falls back to the recorded velib_data_*.json files
+        :param memory_budget: Bytes this system may use before dropping its forecasts
+        :param background_refresh: Serve stale data while refreshing in a background thread
+        """
+        self.name = name
+        self.fetcher_factory = fetcher_factory
+        self.ttl = ttl
+        self.history_dir = history_dir
+        self.recorded_history = recorded_history
+        self.memory_budget = memory_budget
+        self.background_refresh = background_refresh
+        self.on_refresh = None
+        self.lock = threading.Lock()
+        self._refresher = None
+        self._refresher_lock = threading.Lock()
+
+        # Watches are user data: they survive unloading
+        self.alert_queue = QueueSink()
+        self.alert_stream = BroadcastSink()
+        self.alerts = AlertEngine({"queue": self.alert_queue, "webhook": _webhooks, "sse": self.alert_stream})
+        self.last_used = 0.0
+        self._reset()
+
+    def _reset(self):
+        """(Re)create everything derived from upstream data"""
+        self.fetcher = None
+        self.stations = []
+        self.by_code = {}
+        # Stations upstream says the network has, to tell a partial snapshot from the full one
+        self.total_count = 0
+        # When upstream was last asked, and when the data being served was taken
+        self.fetched_at = 0.0
+        self.snapshot_at = None
+        self.summary = SummaryEngine()
+        self.search_index = SearchIndex([])
+        self.trip_planner = TripPlanner([])
+        self.forecasts = ForecastEngine()
+        self.flows = FlowEngine()
+
+    @property
+    def loaded(self):
+        return self.fetcher is not None or bool(self.stations)
+
+    def unload(self, blocking=True):
+        """
+        Drop the snapshot, indexes and statistics; the next query fetches again
+        :param blocking: Wait for a refresh in progress, else give up
+        :return: False if the system was busy and nothing was unloaded
+        """
+        if not self.lock.acquire(blocking=blocking):
+            return False
+        try:
+            self._reset()
+        finally:
+            self.lock.release()
+        return True
+
+    def memory_bytes(self):
+        """Rough memory used by the snapshot, indexes and engines"""
+        return (
+            STATION_BYTES * len(self.stations)
+            + self.search_index.memory_bytes()
+            + 100 * len(self.trip_planner.stations)
+            + self.forecasts.memory_bytes()
+            + self.flows.memory_bytes()
+        )
+
+    def _on_snapshot(self, stations, timestamp=None, history=True, delta=None):
+        """
+        Feed a snapshot to the indexes and incremental engines
+        :param delta: What changed since the previous snapshot, as in GBFSFetcher.delta;
+            the indexes, summary, alerts and flows then only look at those stations
+        """
+        if delta is None:
+            self.by_code = {station.get("stationcode"): station for station in stations}
+            changed = self.summary.update(stations)
+            self.search_index = SearchIndex(stations)
+            self.trip_planner = TripPlanner(stations)
+            self.flows.update(stations, timestamp)
+        else:
+            by_code = dict(self.by_code)
+            for code in delta["removed"]:
+                by_code.pop(code, None)
+            by_code.update((station.get("stationcode"), station) for station in delta["changed"])
+            self.by_code = by_code
+            changed = self.summary.update(delta["changed"], removed=delta["removed"])
+            self.search_index = self.search_index.updated(stations, delta["changed"], delta["removed"])
+            self.trip_planner = self.trip_planner.updated(stations, delta["changed"], delta["removed"])
+            # Stations missing from the input keep their last counts
+            self.flows.update(delta["changed"], timestamp)
+        self.alerts.evaluate(self.by_code[code] for code in changed if code in self.by_code)
+        # Forecasts sample every station at every poll, unchanged ones included
+        self.forecasts.update(stations, timestamp)
+        if history and self.history_dir:
+            append_history(self.history_dir, stations, timestamp or time.time())
+        if self.memory_bytes() > self.memory_budget:
+            print(f"⚠️ {self.name} is over its memory budget, dropping its forecast statistics")
+            self.forecasts = ForecastEngine()
+
+    def seed(self, stations, fetched_at, total_count=None):
+        """
+        Start from a saved snapshot instead of an empty one
+        :param stations: Station list of the snapshot
+        :param fetched_at: When it was taken, it is refreshed once older than the ttl
+        :param total_count: Stations in the network when the snapshot was taken
+        """
+        with self.lock:
+            if self.stations:
+                return
+            self.stations = stations
+            self.total_count = total_count or len(stations)
+            # Already in the recorded history, do not log it again
+            self._on_snapshot(stations, fetched_at, history=False)
+            self.fetched_at = fetched_at
+            self.snapshot_at = fetched_at
+
+    def is_stale(self):
+        """Whether upstream should be asked again: when the fetcher says so (GBFS ttl), else after ttl"""
+        seconds_until_refresh = getattr(self.fetcher, "seconds_until_refresh", None)
+        if seconds_until_refresh is not None:
+            return seconds_until_refresh() <= 0
+        return time.time() - self.fetched_at >= self.ttl
+
+    def get_snapshot(self):
+        """Return the cached station list, refreshing it from upstream when stale"""
+        self.last_used = time.time()
+        if self.background_refresh and self.stations:
+            if self.is_stale():
+                self._refresh_in_background()
+            return self.stations
+        return self._refresh()
+
+    def _refresh_in_background(self):
+        """Start a refresh thread unless one is already running"""
+        # On a serverless instance frozen between invocations, the thread resumes with the next one
+        with self._refresher_lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(target=self._background_worker, name=f"refresh-{self.name}", daemon=True)
+            self._refresher.start()
+
+    def _background_worker(self):
+        try:
+            self._refresh()
+        except Exception as e:
+            print(f"⚠️ Background refresh of {self.name} failed: {e}")
+
+    def _refresh(self):
+        """Fetch from upstream if the snapshot is stale and return the station list"""
+        refreshed = False
+        with self.lock:
+            if self.is_stale():
+                if self.fetcher is None:
+                    self.fetcher = self.fetcher_factory()
+                data = self.fetcher.get_stations()
+                stations = data.get("results") if data else None
+                # Keep serving the previous snapshot if upstream failed; an
+                # unchanged GBFS feed returns the very same list, nothing to redo
+                if stations and stations is not self.stations:
+                    # A delta is only usable if it was computed against what we hold
+                    delta = getattr(self.fetcher, "delta", None)
+                    if delta is not None and delta["since"] is not self.stations:
+                        delta = None
+                    self.stations = stations
+                    self.total_count = data.get("total_count") or len(stations)
+                    self._on_snapshot(stations, delta=delta)
+                    refreshed = True
+                if stations:
+                    # The feed's own timestamp when it has one (GBFS last_updated), so
+                    # the previous result returned on an upstream error keeps ageing
+                    updated = getattr(self.fetcher, "last_updated", None)
+                    self.snapshot_at = updated if isinstance(updated, (int, float)) else time.time()
+                self.fetched_at = time.time()
+            stations = self.stations
+        # Outside of our lock: the registry may unload other systems
+        if refreshed and self.on_refresh is not None:
+            self.on_refresh(self)
+        return stations
+
+    def age(self):
+        """Seconds since the data being served was taken, None before the first snapshot"""
+        return max(time.time() - self.snapshot_at, 0.0) if self.snapshot_at is not None else None
+
+    def coverage(self):
+        """Share of the network's stations present in the snapshot"""
+        return round(len(self.stations) / self.total_count, 4) if self.total_count else None
+
+    def status(self):
+        return {
+            "name": self.name,
+            "loaded": self.loaded,
+            "stations": len(self.stations),
+            "total_count": self.total_count,
+            "fetched_at": self.fetched_at,
+            "snapshot_at": self.snapshot_at,
+            "last_used": self.last_used,
+            "ttl": self.ttl,
+            "refreshing": self._refresher is not None and self._refresher.is_alive(),
+            "memory_bytes": self.memory_bytes(),
+            "memory_budget": self.memory_budget,
+            "watches": len(self.alerts.watches),
+        }
+
+
+class SystemRegistry:
+    def __init__(self, memory_budget=256 * 2 ** 20):
+        """:param memory_budget: Bytes all loaded systems may use together"""
+        self.memory_budget = memory_budget
+        # name -> system, least recently used first
+        self.systems = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, name, fetcher_factory, **options):
+        """
+        Add a system, see StationSystem for the options
+        :raises ValueError: for an invalid or already registered name
+        """
+        if not name or not name.replace("_", "").replace("-", "").isalnum() or name in RESERVED_NAMES:
+            raise ValueError(f"Invalid system name '{name}'")
+        with self._lock:
+            if name in self.systems:
+                raise ValueError(f"System '{name}' is already registered")
+            system = StationSystem(name, fetcher_factory, **options)
+            system.on_refresh = self._enforce_budget
+            self.systems[name] = system
+        return system
+
+    def get(self, name):
+        """
+        Look up a system and mark it as recently used
+        :raises KeyError: for an unknown system
+        """
+        with self._lock:
+            system = self.systems[name]
+            self.systems.move_to_end(name)
+        return system
+
+    def _enforce_budget(self, current):
+        """Unload the least recently used systems until the loaded ones fit in the budget"""
+        with self._lock:
+            loaded = [system for system in self.systems.values() if system.loaded]
+        total = sum(system.memory_bytes() for system in loaded)
+        for system in loaded:
+            if total <= self.memory_budget:
+                break
+            if system is current:
+                continue
+            size = system.memory_bytes()
+            # Runs in the request that refreshed `current`: never wait for another system's fetch
+            if system.unload(blocking=False):
+                total -= size
+                print(f"♻️ Unloaded {system.name} to stay within the memory budget")
+
+    def status(self):
+        return {
+            "memory_budget": self.memory_budget,
+            "systems": [system.status() for system in self.systems.values()],
+        }
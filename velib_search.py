@@ -0,0 +1,57 @@
+"""
+Station name search index.
+
+Built once per snapshot: every lower-cased station name is split into
+trigrams, and a query only checks the stations that contain all of its
+trigrams instead of scanning the whole network. When only station
+counts changed, the new station data is swapped in without rebuilding.
+"""
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    def __init__(self, stations):
+        self.stations = list(stations)
+        self.names = [(station.get("name") or "").lower() for station in self.stations]
+        self.positions = {station.get("stationcode"): position for position, station in enumerate(self.stations)}
+        # trigram -> set of station positions
+        self.postings = {}
+        for position, name in enumerate(self.names):
+            for trigram in _trigrams(name):
+                self.postings.setdefault(trigram, set()).add(position)
+
+    def search(self, query):
+        """Stations whose name contains the query (case insensitive), in snapshot order"""
+        query = query.lower()
+        if len(query) < 3:
+            positions = range(len(self.names))
+        else:
+            postings = sorted((self.postings.get(trigram, set()) for trigram in _trigrams(query)), key=len)
+            positions = sorted(set.intersection(*postings)) if postings[0] else []
+        return [self.stations[position] for position in positions if query in self.names[position]]
+
+    def updated(self, stations, changed, removed):
+        """
+        Index of the next snapshot, given what changed since this one
+        :param stations: Full station list of the new snapshot
+        :param changed: Stations that changed
+        :param removed: Codes of the stations that left the network
+        :return: This index with the changed stations swapped in, or a new
+            index if stations were added, removed or renamed
+        """
+        if removed:
+            return SearchIndex(stations)
+        for station in changed:
+            position = self.positions.get(station.get("stationcode"))
+            if position is None or (station.get("name") or "").lower() != self.names[position]:
+                return SearchIndex(stations)
+        for station in changed:
+            self.stations[self.positions[station.get("stationcode")]] = station
+        return self
+
+    def memory_bytes(self):
+        """Rough size of the index"""
+        return 64 * len(self.names) + 100 * sum(len(positions) for positions in self.postings.values())
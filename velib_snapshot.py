@@ -0,0 +1,142 @@
+"""
+Helpers shared by everything that reads Velib station snapshots
+(desktop app, command line fetcher and web API).
+"""
+from datetime import datetime
+import glob
+import json
+import os
+import sys
+
+# The Opendata records API returns at most this many records per request
+PAGE_SIZE = 100
+
+# Last snapshot fetched by the desktop app, used to paint the window before the network answers
+SNAPSHOT_CACHE = os.path.join(os.path.expanduser("~"), ".velib_finder", "last_snapshot.json")
+
+
+def station_flag(station, key):
+    """
+    Read one of the OUI/NON status fields of a station
+    :param station: Station dictionary as returned by the API
+    :param key: Field name (is_installed, is_renting, is_returning)
+    :return: True if the flag is set
+    """
+    value = station.get(key)
+    if isinstance(value, str):
+        return value.strip().upper() in ("OUI", "YES", "TRUE", "1")
+    return bool(value)
+
+
+def district_of(stationcode):
+    """
+    Commune/arrondissement key of a station, derived from its code.
+    Velib codes are the district number followed by three digits
+    ("16107" is in the 16th arrondissement, "21010" in commune 21).
+    """
+    code = str(stationcode or "")
+    if len(code) <= 3:
+        return "0"
+    return code[:-3]
+
+
+def free_docks(station):
+    """Number of free docks at a station"""
+    capacity = station.get("capacity") or 0
+    bikes = (station.get("ebike") or 0) + (station.get("mechanical") or 0)
+    return max(capacity - bikes, 0)
+
+
+def generate_bikes(stationcode, ebike, mechanical):
+    """
+    Individual bike entries of a station. The API only gives counts, so the
+    numbers are generated: E<code>-001... for e-bikes, M<code>-001... for mechanical ones
+    """
+    bikes = [
+        {"number": f"E{stationcode}-{i+1:03d}", "type": "E-Bike", "status": "Available"}
+        for i in range(ebike)
+    ]
+    bikes.extend(
+        {"number": f"M{stationcode}-{i+1:03d}", "type": "Mechanical", "status": "Available"}
+        for i in range(mechanical)
+    )
+    return bikes
+
+
+def fetch_all_records(fetch_page, limit=None, page_size=PAGE_SIZE):
+    """
+    Page through an Opendata records query until total_count is reached
+    :param fetch_page: Callable(offset, limit) returning the decoded JSON of one page
+    :param limit: Maximum number of records, None for all of them
+    :return: The first page, with the records of every page as its results
+    """
+    data = fetch_page(0, page_size if limit is None else min(page_size, limit))
+    results = list(data.get("results") or [])
+    total = data.get("total_count") or len(results)
+    wanted = total if limit is None else min(total, limit)
+    while len(results) < wanted:
+        page = fetch_page(len(results), min(page_size, wanted - len(results))).get("results") or []
+        if not page:
+            break
+        results.extend(page)
+    data["results"] = results
+    data["total_count"] = total
+    return data
+
+
+def recorded_snapshots():
+    """Dated velib_data_*.json files, newest first (working directory, then bundled ones)"""
+    folders = [os.getcwd(), os.path.dirname(os.path.abspath(__file__))]
+    # PyInstaller unpacks bundled data files here
+    if getattr(sys, "_MEIPASS", None):
+        folders.append(sys._MEIPASS)
+    files = []
+    for folder in dict.fromkeys(folders):
+        files.extend(glob.glob(os.path.join(folder, "velib_data_*.json")))
+    return sorted(files, key=os.path.basename, reverse=True)
+
+
+def snapshot_time(path):
+    """When a snapshot was taken: from the velib_data_YYYYmmdd_HHMMSS name if present, else its mtime"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name.startswith("velib_data_"):
+        try:
+            return datetime.strptime(name[len("velib_data_"):], "%Y%m%d_%H%M%S").timestamp()
+        except ValueError:
+            pass
+    return os.path.getmtime(path)
+
+
+def load_last_snapshot(path=SNAPSHOT_CACHE):
+    """
+    Load the most recent snapshot available on disk
+    :param path: Snapshot cache written by save_last_snapshot
+    :return: (data, saved_at timestamp) or (None, None) if nothing usable was found
+    """
+    candidates = [path] + recorded_snapshots()
+    for candidate in candidates:
+        try:
+            with open(candidate, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict) and data.get("results"):
+                return data, snapshot_time(candidate)
+        except (OSError, ValueError):
+            continue
+    return None, None
+
+
+def save_last_snapshot(data, path=SNAPSHOT_CACHE):
+    """
+    Persist a snapshot for the next start. The file is replaced atomically
+    so a crash never leaves a half written cache behind.
+    """
+    if not data or not data.get("results"):
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error saving snapshot cache: {e}")
@@ -0,0 +1,135 @@
+"""
+Network and arrondissement aggregates kept up to date from snapshot deltas.
+
+Instead of summing over every station each time a new snapshot arrives,
+the engine remembers the counters each station contributed last time and
+only applies the difference for stations whose numbers actually changed.
+"""
+import threading
+
+from velib_snapshot import station_flag, district_of
+
+# Counters kept for the whole network and for each district
+COUNTERS = ("stations", "active", "ebike", "mechanical", "capacity", "empty", "full")
+
+
+def _new_counters():
+    return dict.fromkeys(COUNTERS, 0)
+
+
+class SummaryEngine:
+    def __init__(self):
+        # stationcode -> (district, contribution tuple in COUNTERS order)
+        self._contributions = {}
+        self.totals = _new_counters()
+        self.districts = {}
+        self.updates = 0
+        self.last_changed = 0
+        # The web API reads the aggregates while a refresh thread updates them
+        self._lock = threading.Lock()
+
+    def _contribution(self, station):
+        """Values a single station adds to the counters, in COUNTERS order"""
+        ebike = station.get("ebike") or 0
+        mechanical = station.get("mechanical") or 0
+        capacity = station.get("capacity") or 0
+        bikes = ebike + mechanical
+        active = station_flag(station, "is_installed") and station_flag(station, "is_renting")
+        return (
+            1,
+            1 if active else 0,
+            ebike,
+            mechanical,
+            capacity,
+            1 if bikes == 0 else 0,
+            1 if capacity and bikes >= capacity else 0,
+        )
+
+    def _apply(self, district, contribution, sign):
+        counters = self.districts.get(district)
+        if counters is None:
+            counters = self.districts[district] = _new_counters()
+        for key, value in zip(COUNTERS, contribution):
+            if value:
+                self.totals[key] += sign * value
+                counters[key] += sign * value
+        if counters["stations"] == 0:
+            del self.districts[district]
+
+    def update(self, stations, removed=None):
+        """
+        Apply a new snapshot to the aggregates
+        :param stations: List of station dictionaries (the "results" of the API)
+        :param removed: Codes of the stations that left the network. When given,
+            stations only needs to hold the ones that changed
+        :return: Set of station codes whose contribution changed
+        """
+        with self._lock:
+            return self._update(stations, removed)
+
+    def _update(self, stations, removed):
+        changed = set()
+        seen = set()
+        for station in stations:
+            code = station.get("stationcode")
+            if code is None:
+                continue
+            seen.add(code)
+            new = (district_of(code), self._contribution(station))
+            old = self._contributions.get(code)
+            if old == new:
+                continue
+            if old is not None:
+                self._apply(old[0], old[1], -1)
+            self._apply(new[0], new[1], 1)
+            self._contributions[code] = new
+            changed.add(code)
+
+        # Stations that disappeared from the feed
+        if removed is None:
+            removed = [c for c in self._contributions if c not in seen]
+        for code in removed:
+            if code not in self._contributions:
+                continue
+            district, contribution = self._contributions.pop(code)
+            self._apply(district, contribution, -1)
+            changed.add(code)
+
+        self.updates += 1
+        self.last_changed = len(changed)
+        return changed
+
+    @staticmethod
+    def _describe(counters):
+        result = dict(counters)
+        bikes = counters["ebike"] + counters["mechanical"]
+        result["bikes"] = bikes
+        result["docks"] = max(counters["capacity"] - bikes, 0)
+        result["occupancy"] = round(bikes / counters["capacity"], 4) if counters["capacity"] else 0.0
+        return result
+
+    def network(self):
+        """Network wide totals with derived ratios"""
+        with self._lock:
+            return self._describe(self.totals)
+
+    def district(self, name):
+        """Totals for a single commune/arrondissement, or None if unknown"""
+        with self._lock:
+            counters = self.districts.get(name)
+            if counters is None:
+                return None
+            return self._describe(counters)
+
+    def as_dict(self):
+        """Full summary, ready to be serialized as JSON"""
+        with self._lock:
+            return {
+                "network": self._describe(self.totals),
+                "districts": {
+                    name: self._describe(counters)
+                    for name, counters in sorted(self.districts.items(), key=lambda item: item[0].zfill(5))
+                },
+                "updates": self.updates,
+                "last_changed": self.last_changed,
+            }
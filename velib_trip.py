@@ -0,0 +1,248 @@
+"""
+Trip planner: pick the best pickup and drop-off station pair for a trip.
+
+A TripPlanner is built once per snapshot. Station positions are projected
+to metres and stored in flat arrays together with a coarse grid index, so
+a query only looks at the few cells around each end of the trip. When
+stations did not move, the next snapshot only patches their counts.
+"""
+from array import array
+import copy
+import math
+
+from velib_snapshot import station_flag, free_docks
+
+# Metres per degree of latitude, and reference latitude of the projection
+# when there are no stations to take it from (Paris)
+METERS_PER_DEGREE = 111320.0
+REFERENCE_LAT = 48.8566
+# Grid cell size in metres
+CELL_SIZE = 500.0
+# Average speeds in metres per second
+WALK_SPEED = 1.3
+RIDE_SPEED = 4.5
+# Extra seconds added when a station has a single bike/dock left, divided by
+# the count for larger margins (the bike may be gone when we get there)
+MARGIN_PENALTY = 180.0
+
+BIKE_TYPES = ("any", "ebike", "mechanical")
+
+
+def parse_point(value):
+    """
+    Parse a "lat,lon" string
+    :return: (lat, lon) tuple
+    :raises ValueError: if the value is not two valid coordinates
+    """
+    try:
+        lat, lon = (float(part) for part in value.split(","))
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError(f"Invalid coordinates '{value}', expected 'lat,lon'")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"Coordinates out of range: '{value}'")
+    return lat, lon
+
+
+class TripPlanner:
+    def __init__(self, stations):
+        # Project around the middle of the network: a fixed latitude skews east-west distances elsewhere
+        latitudes = [
+            coords["lat"] for coords in (station.get("coordonnees_geo") or {} for station in stations)
+            if coords.get("lat") is not None and coords.get("lon") is not None
+        ]
+        self.reference_lat = (min(latitudes) + max(latitudes)) / 2 if latitudes else REFERENCE_LAT
+        self._lon_scale = METERS_PER_DEGREE * math.cos(math.radians(self.reference_lat))
+        self.stations = []
+        self.x = array('d')
+        self.y = array('d')
+        self.ebike = array('i')
+        self.mechanical = array('i')
+        self.docks = array('i')
+        self.renting = array('b')
+        self.returning = array('b')
+        self.grid = {}
+        # stationcode -> index in the arrays, and codes of stations without coordinates
+        self.indexes = {}
+        self.unplaced = set()
+
+        for station in stations:
+            coords = station.get("coordonnees_geo") or {}
+            if coords.get("lat") is None or coords.get("lon") is None:
+                self.unplaced.add(station.get("stationcode"))
+                continue
+            x, y = self._project(coords["lat"], coords["lon"])
+            index = len(self.stations)
+            self.indexes[station.get("stationcode")] = index
+            self.stations.append(station)
+            self.x.append(x)
+            self.y.append(y)
+            self.ebike.append(station.get("ebike") or 0)
+            self.mechanical.append(station.get("mechanical") or 0)
+            self.docks.append(free_docks(station))
+            self.renting.append(station_flag(station, "is_installed") and station_flag(station, "is_renting"))
+            self.returning.append(station_flag(station, "is_installed") and station_flag(station, "is_returning"))
+            self.grid.setdefault(self._cell(x, y), []).append(index)
+
+        # Grid bounds, to know when a ring search has covered everything
+        cells = list(self.grid)
+        self.bounds = (
+            min((gx for gx, _ in cells), default=0),
+            max((gx for gx, _ in cells), default=-1),
+            min((gy for _, gy in cells), default=0),
+            max((gy for _, gy in cells), default=-1),
+        )
+
+        # Bikes usable for each kind of trip, precomputed once per snapshot
+        self.bikes = {
+            "ebike": self.ebike,
+            "mechanical": self.mechanical,
+            "any": array('i', (e + m for e, m in zip(self.ebike, self.mechanical))),
+        }
+
+    def updated(self, stations, changed, removed):
+        """
+        Planner of the next snapshot, given what changed since this one
+        :param stations: Full station list of the new snapshot
+        :param changed: Stations that changed
+        :param removed: Codes of the stations that left the network
+        :return: A copy of this planner with the counts of the changed stations patched,
+            or a new planner if stations were added, removed or moved
+        """
+        if removed:
+            return TripPlanner(stations)
+        for station in changed:
+            code = station.get("stationcode")
+            index = self.indexes.get(code)
+            coords = station.get("coordonnees_geo") or {}
+            if index is None:
+                # Still without coordinates: still not on the map
+                if code in self.unplaced and (coords.get("lat") is None or coords.get("lon") is None):
+                    continue
+                return TripPlanner(stations)
+            if station.get("coordonnees_geo") != self.stations[index].get("coordonnees_geo"):
+                return TripPlanner(stations)
+        # Requests keep planning on this one while the copy is patched: only the
+        # counts are copied, positions, grid and indexes do not change and are shared
+        planner = copy.copy(self)
+        planner.stations = list(self.stations)
+        planner.ebike = array('i', self.ebike)
+        planner.mechanical = array('i', self.mechanical)
+        planner.docks = array('i', self.docks)
+        planner.renting = array('b', self.renting)
+        planner.returning = array('b', self.returning)
+        any_bikes = array('i', self.bikes["any"])
+        planner.bikes = {"ebike": planner.ebike, "mechanical": planner.mechanical, "any": any_bikes}
+        for station in changed:
+            index = self.indexes.get(station.get("stationcode"))
+            if index is None:
+                continue
+            planner.stations[index] = station
+            planner.ebike[index] = station.get("ebike") or 0
+            planner.mechanical[index] = station.get("mechanical") or 0
+            any_bikes[index] = planner.ebike[index] + planner.mechanical[index]
+            planner.docks[index] = free_docks(station)
+            planner.renting[index] = station_flag(station, "is_installed") and station_flag(station, "is_renting")
+            planner.returning[index] = station_flag(station, "is_installed") and station_flag(station, "is_returning")
+        return planner
+
+    def _project(self, lat, lon):
+        return lon * self._lon_scale, lat * METERS_PER_DEGREE
+
+    @staticmethod
+    def _cell(x, y):
+        return int(x // CELL_SIZE), int(y // CELL_SIZE)
+
+    def nearest(self, lat, lon, k, counts, allowed):
+        """
+        Find the k nearest stations with a positive count
+        :param counts: Array of bikes or docks per station
+        :param allowed: Array of station flags (renting or returning)
+        :return: List of (distance in metres, station index, count), nearest first
+        """
+        x, y = self._project(lat, lon)
+        cx, cy = self._cell(x, y)
+        found = []
+        if not self.grid:
+            return found
+        min_x, max_x, min_y, max_y = self.bounds
+        # Skip the empty rings between a far away point and the grid
+        ring = max(0, min_x - cx, cx - max_x, min_y - cy, cy - max_y)
+        max_ring = max(cx - min_x, max_x - cx, cy - min_y, max_y - cy)
+        while ring <= max_ring:
+            # Only the border of the square is new in this ring, clipped to the grid
+            for gx in range(max(cx - ring, min_x), min(cx + ring, max_x) + 1):
+                if gx == cx - ring or gx == cx + ring:
+                    rows = range(max(cy - ring, min_y), min(cy + ring, max_y) + 1)
+                else:
+                    rows = {cy - ring, cy + ring}
+                for gy in rows:
+                    for index in self.grid.get((gx, gy), ()):
+                        count = counts[index]
+                        if count > 0 and allowed[index]:
+                            found.append((math.hypot(self.x[index] - x, self.y[index] - y), index, count))
+            # Anything outside this ring is at least ring * CELL_SIZE away
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= ring * CELL_SIZE:
+                    break
+            ring += 1
+        found.sort()
+        return found[:k]
+
+    def plan(self, origin, destination, bike="any", k=5, limit=3):
+        """
+        Score pickup x drop-off pairs around both ends of a trip
+        :param origin: (lat, lon) of the start
+        :param destination: (lat, lon) of the destination
+        :param bike: "any", "ebike" or "mechanical"
+        :param k: Number of candidate stations at each end
+        :param limit: Number of options to return
+        :return: List of trip options, best first
+        """
+        if bike not in self.bikes:
+            raise ValueError(f"Unknown bike type '{bike}', expected one of {', '.join(BIKE_TYPES)}")
+        bikes = self.bikes[bike]
+        pickups = self.nearest(origin[0], origin[1], k, bikes, self.renting)
+        dropoffs = self.nearest(destination[0], destination[1], k, self.docks, self.returning)
+        if not pickups or not dropoffs:
+            return []
+
+        # Per-candidate costs are computed once, pairs only add the ride leg.
+        # The counts are the ones the candidates were picked with, never read again
+        pickup_cost = [d / WALK_SPEED + MARGIN_PENALTY / count for d, _, count in pickups]
+        dropoff_cost = [d / WALK_SPEED + MARGIN_PENALTY / count for d, _, count in dropoffs]
+        scored = []
+        for p, (_, pi, _) in enumerate(pickups):
+            px, py = self.x[pi], self.y[pi]
+            for q, (_, di, _) in enumerate(dropoffs):
+                if pi == di:
+                    continue
+                ride = math.hypot(self.x[di] - px, self.y[di] - py) / RIDE_SPEED
+                scored.append((pickup_cost[p] + ride + dropoff_cost[q], p, q, ride))
+        scored.sort()
+
+        options = []
+        for score, p, q, ride in scored[:limit]:
+            walk_to, pi, bikes_left = pickups[p]
+            walk_from, di, docks_left = dropoffs[q]
+            options.append({
+                "score": round(score),
+                "pickup": self._describe(pi, walk_to, bikes_left),
+                "dropoff": self._describe(di, walk_from, docks_left),
+                "walk_seconds": round((walk_to + walk_from) / WALK_SPEED),
+                "ride_seconds": round(ride),
+            })
+        return options
+
+    def _describe(self, index, distance, available):
+        station = self.stations[index]
+        return {
+            "stationcode": station.get("stationcode"),
+            "name": station.get("name"),
+            "distance": round(distance),
+            "available": available,
+            "ebike": self.ebike[index],
+            "mechanical": self.mechanical[index],
+            "docks": self.docks[index],
+            "coordonnees_geo": station.get("coordonnees_geo"),
+        }
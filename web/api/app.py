@@ -1,27 +1,59 @@
-from flask import Flask, jsonify, request
+import time
+
+# Reference point of the cold start measurement, taken before the heavy imports
+_START_TIME = time.perf_counter()
+
+from flask import Flask, Response, g, jsonify, request, send_from_directory, stream_with_context
 from flask_cors import CORS
-import requests
 import json
 import os
+import queue
+import secrets
+import sys
+
+# Shared modules (velib_snapshot, velib_summary, ...) live at the repository root
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from velib_registry import SystemRegistry
+from velib_snapshot import fetch_all_records, load_last_snapshot
+from velib_trip import parse_point
+from velib_export import FORMATS, check_format, export, iter_rows, parse_columns, parse_time
+
+WEB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES_DIR = os.path.join(WEB_DIR, 'templates')
 
 # Create a simplified VelibFetcher class directly in the app
 class VelibFetcher:
     def __init__(self):
         self.base_url = "https://opendata.paris.fr/api/explore/v2.1/catalog/datasets/velib-disponibilite-en-temps-reel/records"
+        # Serve a recorded snapshot instead of calling upstream (local runs and load tests)
+        self.replay_file = os.environ.get("VELIB_REPLAY_FILE")
 
-    def get_stations(self, limit=100):
+    def get_stations(self, limit=None):
+        if self.replay_file:
+            with open(self.replay_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        # Imported on first use, it is the slowest import of a cold start
+        import requests
         try:
-            params = {
-                "limit": limit,
-                "select": "stationcode,name,capacity,ebike,mechanical,is_installed,is_renting,is_returning,coordonnees_geo"
-            }
             headers = {
                 "User-Agent": "VelibStationFinder/1.0 (+https://vercel.com)"
             }
-            response = requests.get(self.base_url, params=params, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
+
+            def fetch_page(offset, page_limit):
+                params = {
+                    "limit": page_limit,
+                    "offset": offset,
+                    "select": "stationcode,name,capacity,ebike,mechanical,is_installed,is_renting,is_returning,coordonnees_geo"
+                }
+                response = requests.get(self.base_url, params=params, headers=headers, timeout=10)
+                response.raise_for_status()
+                return response.json()
+
+            # The API caps a request at 100 records, page through the whole network
+            data = fetch_all_records(fetch_page, limit)
             
             # Generate individual bike information for each station
             if "results" in data:
@@ -59,9 +91,122 @@ class VelibFetcher:
             # Return an empty structure to avoid 500s in handlers
             return {"results": []}
 
+def gbfs_fetcher(gbfs_url=None):
+    """Fetcher of a GBFS system, the module is only imported by systems that use it"""
+    from velib_gbfs import GBFSFetcher
+    return GBFSFetcher(gbfs_url)
+
 # Create Flask app
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+app = Flask(__name__, static_folder=os.path.join(WEB_DIR, 'static'), static_url_path='/static')
+# Enable CORS for all routes, and let cross-origin clients read the freshness headers
+CORS(app, expose_headers=['X-Snapshot-Time', 'X-Snapshot-Age'])
+
+# Seconds a fetched snapshot is reused before asking upstream again
+SNAPSHOT_TTL = int(os.environ.get("VELIB_SNAPSHOT_TTL", 60))
+# Optional folder where every refreshed snapshot is logged for /api/export
+HISTORY_DIR = os.environ.get("VELIB_HISTORY_DIR")
+# Memory budgets, in MB, of each system and of all loaded systems together
+SYSTEM_BUDGET = int(os.environ.get("VELIB_SYSTEM_BUDGET_MB", 64)) * 2 ** 20
+TOTAL_BUDGET = int(os.environ.get("VELIB_MEMORY_BUDGET_MB", 256)) * 2 ** 20
+# System served by the un-namespaced /api/... routes
+DEFAULT_SYSTEM = "velib"
+# Serverless mode: answer from the bundled last-known snapshot and refresh in the background
+COLD_START = os.environ.get("VELIB_COLD_START") == "1"
+
+registry = SystemRegistry(memory_budget=TOTAL_BUDGET)
+# VELIB_SOURCE=gbfs reads the GBFS feeds instead of the Opendata records API
+registry.register(
+    DEFAULT_SYSTEM,
+    gbfs_fetcher if os.environ.get("VELIB_SOURCE") == "gbfs" else VelibFetcher,
+    ttl=SNAPSHOT_TTL,
+    history_dir=HISTORY_DIR,
+    recorded_history=True,
+    memory_budget=SYSTEM_BUDGET,
+    background_refresh=COLD_START
+)
+# Other networks: VELIB_SYSTEMS="lyon=https://.../gbfs.json,bordeaux=https://.../gbfs.json"
+for entry in filter(None, os.environ.get("VELIB_SYSTEMS", "").split(",")):
+    name, _, gbfs_url = entry.strip().partition("=")
+    registry.register(
+        name,
+        lambda gbfs_url=gbfs_url: gbfs_fetcher(gbfs_url),
+        ttl=SNAPSHOT_TTL,
+        history_dir=os.path.join(HISTORY_DIR, name) if HISTORY_DIR else None,
+        memory_budget=SYSTEM_BUDGET,
+        background_refresh=COLD_START
+    )
+
+# Cold start figures, reported by /test and in the Server-Timing header of the first response
+cold_start = {"mode": COLD_START, "seeded_from": None, "seed_skipped": None, "seed_ms": None,
+              "first_request_ms": None, "first_request_path": None, "requests": 0}
+if COLD_START:
+    seed_start = time.perf_counter()
+    data, saved_at = load_last_snapshot()
+    # However old it is: responses carry its age (X-Snapshot-Age) and the page marks it as stale
+    if data:
+        registry.get(DEFAULT_SYSTEM).seed(data["results"], saved_at, data.get("total_count"))
+        cold_start["seeded_from"] = saved_at
+    else:
+        cold_start["seed_skipped"] = "no snapshot found"
+    cold_start["seed_ms"] = round(1000 * (time.perf_counter() - seed_start), 1)
+    if cold_start["seed_skipped"]:
+        print(f"⚠️ Not seeding from the bundled snapshot: {cold_start['seed_skipped']}")
+cold_start["import_ms"] = round(1000 * (time.perf_counter() - _START_TIME), 1)
+print(f"⏱️ App ready in {cold_start['import_ms']} ms")
+
+@app.before_request
+def count_request():
+    cold_start["requests"] += 1
+    g.first_request = cold_start["requests"] == 1
+
+@app.after_request
+def report_cold_start(response):
+    if g.get("first_request"):
+        cold_start["first_request_ms"] = round(1000 * (time.perf_counter() - _START_TIME), 1)
+        cold_start["first_request_path"] = request.path
+        timings = [f"import;dur={cold_start['import_ms']}", f"cold-start;dur={cold_start['first_request_ms']}"]
+        if cold_start["seed_ms"] is not None:
+            timings.append(f"seed;dur={cold_start['seed_ms']}")
+        response.headers["Server-Timing"] = ", ".join(timings)
+    return response
+
+@app.after_request
+def add_snapshot_age(response):
+    """How old the served station data is, so stale data never passes for live availability"""
+    system = g.get("system")
+    if system is not None and system.snapshot_at is not None:
+        response.headers["X-Snapshot-Time"] = str(int(system.snapshot_at))
+        response.headers["X-Snapshot-Age"] = str(int(system.age()))
+    return response
+
+# /api/velib/stations must not be redirected to /api/stations
+app.url_map.redirect_defaults = False
+
+def system_route(rule, **options):
+    """Register a view under /api/<system><rule>, and under /api<rule> for the default system"""
+    def decorator(view):
+        app.add_url_rule(f"/api{rule}", view_func=view, defaults={"system": DEFAULT_SYSTEM}, **options)
+        app.add_url_rule(f"/api/<system>{rule}", view_func=view, **options)
+        return view
+    return decorator
+
+class UnknownSystem(Exception):
+    pass
+
+@app.errorhandler(UnknownSystem)
+def unknown_system(e):
+    return jsonify({"error": f"Unknown system {e}"}), 404
+
+def get_system(name, refresh=True):
+    """Look up a system and make sure its snapshot is fresh"""
+    try:
+        system = registry.get(name)
+    except KeyError:
+        raise UnknownSystem(name)
+    if refresh:
+        system.get_snapshot()
+    g.system = system
+    return system
 
 @app.route('/favicon.ico')
 def favicon():
@@ -73,160 +218,228 @@ def robots():
 
 @app.route('/')
 def index():
-    html_content = """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Velib Station Finder - Lucas Guichard</title>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" rel="stylesheet">
-        <style>
-            body { background-color: #f8f9fa; }
-            .station-card { cursor: pointer; transition: transform 0.2s; }
-            .station-card:hover { transform: translateY(-2px); }
-            .loading { text-align: center; padding: 20px; }
-        </style>
-    </head>
-    <body>
-        <div class="container mt-4">
-            <h1 class="text-center mb-4">🚲 Velib Station Finder</h1>
-            
-            <!-- Search Bar -->
-            <div class="row mb-4">
-                <div class="col-md-8 mx-auto">
-                    <div class="input-group">
-                        <input type="text" id="searchInput" class="form-control" placeholder="Search for a station...">
-                        <button class="btn btn-primary" onclick="searchStations()">Search</button>
-                        <button class="btn btn-secondary" onclick="refreshData()">Refresh</button>
-                    </div>
-                </div>
-            </div>
-
-            <!-- Loading Indicator -->
-            <div id="loading" class="text-center d-none">
-                <div class="spinner-border text-primary" role="status">
-                    <span class="visually-hidden">Loading...</span>
-                </div>
-            </div>
-
-            <!-- Stations Container -->
-            <div id="stationsContainer">
-                <div class="loading">Click "Refresh" to load stations</div>
-            </div>
-        </div>
-
-        <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js"></script>
-        <script>
-            async function refreshData() {
-                const loading = document.getElementById('loading');
-                const container = document.getElementById('stationsContainer');
-                
-                loading.classList.remove('d-none');
-                container.innerHTML = '';
-                
-                try {
-                    const response = await fetch('/api/stations');
-                    const stations = await response.json();
-                    displayStations(stations);
-                } catch (error) {
-                    container.innerHTML = '<div class="alert alert-danger">Error loading stations</div>';
-                } finally {
-                    loading.classList.add('d-none');
-                }
-            }
-            
-            async function searchStations() {
-                const query = document.getElementById('searchInput').value;
-                if (!query) return refreshData();
-                
-                const loading = document.getElementById('loading');
-                const container = document.getElementById('stationsContainer');
-                
-                loading.classList.remove('d-none');
-                container.innerHTML = '';
-                
-                try {
-                    const response = await fetch(`/api/stations/search/${encodeURIComponent(query)}`);
-                    const stations = await response.json();
-                    displayStations(stations);
-                } catch (error) {
-                    container.innerHTML = '<div class="alert alert-danger">Error searching stations</div>';
-                } finally {
-                    loading.classList.add('d-none');
-                }
-            }
-            
-            function displayStations(stations) {
-                const container = document.getElementById('stationsContainer');
-                
-                if (stations.length === 0) {
-                    container.innerHTML = '<div class="alert alert-info">No stations found</div>';
-                    return;
-                }
-                
-                const stationsHtml = stations.map(station => `
-                    <div class="card mb-3 station-card" onclick="showStationDetails('${station.name}')">
-                        <div class="card-body">
-                            <h5 class="card-title">${station.name}</h5>
-                            <p class="card-text">
-                                <strong>E-Bikes:</strong> ${station.ebike || 0} | 
-                                <strong>Mechanical:</strong> ${station.mechanical || 0}
-                            </p>
-                            <span class="badge ${station.is_installed && station.is_renting ? 'bg-success' : 'bg-danger'}">
-                                ${station.is_installed && station.is_renting ? 'Active' : 'Inactive'}
-                            </span>
-                        </div>
-                    </div>
-                `).join('');
-                
-                container.innerHTML = stationsHtml;
-            }
-            
-            function showStationDetails(stationName) {
-                alert('Station details for: ' + stationName + '\\n\\nThis would show individual bike details in a full implementation.');
-            }
-            
-            // Load stations on page load
-            refreshData();
-        </script>
-    </body>
-    </html>
-    """
-    return html_content
+    # Prebuilt page, on Vercel it is served by the static build without invoking the function
+    return send_from_directory(TEMPLATES_DIR, 'index.html')
 
 @app.route('/test')
 def test():
-    return jsonify({"status": "ok", "message": "VelibFinder API is working!"})
+    return jsonify({"status": "ok", "message": "VelibFinder API is working!", "cold_start": cold_start})
+
+@app.route('/api/systems', methods=['GET'])
+def list_systems():
+    """Registered bike-share systems, their memory use and whether they are loaded"""
+    return jsonify(registry.status())
 
-@app.route('/api/stations', methods=['GET'])
-def get_stations():
+@system_route('/stations', methods=['GET'])
+def get_stations(system):
     try:
-        fetcher = VelibFetcher()
-        data = fetcher.get_stations()
-        if data and "results" in data:
-            return jsonify(data["results"])
         # Graceful empty array if upstream fails
-        return jsonify([])
+        return jsonify(get_system(system).stations)
+    except UnknownSystem:
+        raise
     except Exception as e:
         # Never crash the function; return empty list to keep UI up
         return jsonify([])
 
-@app.route('/api/stations/search/<query>', methods=['GET'])
-def search_stations(query):
+@system_route('/stations/search/<query>', methods=['GET'])
+def search_stations(system, query):
     try:
-        fetcher = VelibFetcher()
-        data = fetcher.get_stations()
-        if data and "results" in data:
-            stations = data["results"]
-            filtered_stations = [
-                station for station in stations
-                if query.lower() in station.get("name", "").lower()
-            ]
-            return jsonify(filtered_stations)
-        return jsonify([])
+        return jsonify(get_system(system).search_index.search(query))
+    except UnknownSystem:
+        raise
     except Exception as e:
         return jsonify([])
 
+@system_route('/stations/<code>', methods=['GET'])
+def get_station(system, code):
+    """Full data of a single station, bikes included"""
+    station = get_system(system).by_code.get(code)
+    if station is None:
+        return jsonify({"error": f"Unknown station {code}"}), 404
+    return jsonify(station)
+
+@system_route('/stations/<code>/forecast', methods=['GET'])
+def forecast_station(system, code):
+    """Expected bikes at a station in ?minutes= (default 15) and the risk of it being empty"""
+    try:
+        minutes = int(request.args.get('minutes', 15))
+        if not 0 < minutes <= 180:
+            return jsonify({"error": "minutes must be between 1 and 180"}), 400
+        result = get_system(system).forecasts.forecast(code, minutes)
+        if result is None:
+            return jsonify({"error": f"Unknown station {code}"}), 404
+        return jsonify(result)
+    except UnknownSystem:
+        raise
+    except ValueError:
+        return jsonify({"error": "minutes must be an integer"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@system_route('/flows', methods=['GET'])
+def get_flows(system):
+    """Pickups and returns inferred from consecutive snapshots: ?window=15m|1h|24h&limit=&station="""
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 0), 2000)
+        return jsonify(get_system(system).flows.flows(
+            request.args.get('window', '1h'),
+            limit=limit,
+            stationcode=request.args.get('station')
+        ))
+    except UnknownSystem:
+        raise
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@system_route('/export', methods=['GET'])
+def export_stations(system):
+    """Stream historical station rows: ?format=ndjson|csv|parquet&from=&to=&columns=&gzip=1"""
+    current = get_system(system, refresh=False)
+    try:
+        fmt = request.args.get('format', 'ndjson')
+        check_format(fmt)
+        columns = parse_columns(request.args.get('columns'))
+        start = parse_time(request.args.get('from'))
+        end = parse_time(request.args.get('to'))
+        compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = iter_rows(start, end, current.history_dir, recorded=current.recorded_history)
+    filename = f"{system}_export.{fmt}" + (".gz" if compress else "")
+    # No Content-Length: the body is sent with chunked transfer encoding
+    return Response(
+        export(rows, fmt, columns, compress),
+        mimetype='application/gzip' if compress else FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@system_route('/watches', methods=['POST'])
+def create_watch(system):
+    """Register a watch, e.g. {"stationcode": "16107", "metric": "ebike", "op": ">=", "threshold": 1}"""
+    current = get_system(system)
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    try:
+        code = body.get('stationcode', '')
+        watch = current.alerts.add_watch(
+            code,
+            body.get('metric', 'bikes'),
+            body.get('op', '>='),
+            body.get('threshold', 1),
+            sink=body.get('sink', 'queue'),
+            target=body.get('target'),
+            cooldown=body.get('cooldown', 300),
+            station=current.by_code.get(str(code))
+        )
+        # The token is only ever returned here, it is needed to read or delete the watch
+        return jsonify(dict(watch.as_dict(), token=watch.token)), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@system_route('/watches/<int:watch_id>', methods=['GET', 'DELETE'])
+def manage_watch(system, watch_id):
+    """Inspect or remove a watch, with its token in the X-Watch-Token header or ?token="""
+    alerts = get_system(system, refresh=False).alerts
+    watch = alerts.watches.get(watch_id)
+    if watch is None:
+        return jsonify({"error": f"Unknown watch {watch_id}"}), 404
+    token = request.headers.get('X-Watch-Token') or request.args.get('token', '')
+    if not secrets.compare_digest(token, watch.token):
+        return jsonify({"error": "Missing or invalid watch token"}), 403
+    if request.method == 'DELETE':
+        alerts.remove_watch(watch_id)
+        return '', 204
+    return jsonify(watch.as_dict())
+
+def watch_ids_of_request(alerts):
+    """Ids of the watches whose tokens the request holds (comma separated, X-Watch-Token or ?token=)"""
+    tokens = request.headers.get('X-Watch-Token') or request.args.get('token', '')
+    return alerts.watch_ids(filter(None, (token.strip() for token in tokens.split(','))))
+
+@system_route('/alerts', methods=['GET'])
+def get_alerts(system):
+    """Notifications of "queue" watches newer than ?since=<seq>, for the watches whose tokens are given"""
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({"error": "since must be an integer"}), 400
+    current = get_system(system)
+    watch_ids = watch_ids_of_request(current.alerts)
+    if not watch_ids:
+        return jsonify({"error": "Missing or invalid watch token"}), 403
+    return jsonify(current.alert_queue.since(since, watch_ids=watch_ids))
+
+@system_route('/alerts/stream', methods=['GET'])
+def stream_alerts(system):
+    """Server-sent events for "sse" watches, for the watches whose tokens are given"""
+    current = get_system(system)
+    watch_ids = watch_ids_of_request(current.alerts)
+    if not watch_ids:
+        return jsonify({"error": "Missing or invalid watch token"}), 403
+    subscriber = current.alert_stream.subscribe()
+
+    def events():
+        try:
+            while True:
+                try:
+                    notification = subscriber.get(timeout=15)
+                    if notification["watch_id"] not in watch_ids:
+                        continue
+                    yield f"id: {notification['seq']}\ndata: {json.dumps(notification)}\n\n"
+                except queue.Empty:
+                    # Keep the connection alive, and refresh the snapshot so watches get evaluated
+                    current.get_snapshot()
+                    yield ": keep-alive\n\n"
+        finally:
+            current.alert_stream.unsubscribe(subscriber)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+@system_route('/summary', methods=['GET'])
+def get_summary(system):
+    """Network totals and per-arrondissement breakdown, optionally for one district"""
+    try:
+        current = get_system(system)
+        district = request.args.get('district')
+        if district:
+            result = current.summary.district(district)
+            if result is None:
+                return jsonify({"error": f"Unknown district {district}"}), 404
+            return jsonify(result)
+        result = current.summary.as_dict()
+        result["fetched_at"] = current.fetched_at
+        result["snapshot_at"] = current.snapshot_at
+        result["age"] = current.age()
+        # A partial snapshot must not pass for the whole network
+        result["total_count"] = current.total_count
+        result["coverage"] = current.coverage()
+        return jsonify(result)
+    except UnknownSystem:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@system_route('/trip', methods=['GET'])
+def plan_trip(system):
+    """Best pickup/drop-off station pairs for a trip: ?from=lat,lon&to=lat,lon&bike=ebike|any"""
+    try:
+        origin = parse_point(request.args.get('from'))
+        destination = parse_point(request.args.get('to'))
+        bike = request.args.get('bike', 'any')
+        limit = min(max(int(request.args.get('limit', 3)), 1), 10)
+        planner = get_system(system).trip_planner
+        return jsonify(planner.plan(origin, destination, bike=bike, limit=limit))
+    except UnknownSystem:
+        raise
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 8080))) 
\ No newline at end of file
+    app.run(debug=os.environ.get('FLASK_DEBUG', '1') == '1', host='0.0.0.0', port=int(os.environ.get('PORT', 8080))) 
\ No newline at end of file
@@ -1,26 +1,58 @@
 // Global variables
-let stations = [];
+const stations = new Map();   // stationcode -> station
+let searchIndex = [];         // [normalized name, stationcode] for every station
+let visibleCodes = [];        // stationcodes matching the current search, in display order
 const API_BASE_URL = '/api';
 
+// Virtual scrolling: only the rows in the viewport (plus a margin) exist in the DOM
+const OVERSCAN = 8;
+let rowHeight = 41;
+const rowPool = [];
+let topSpacer = null;
+let bottomSpacer = null;
+let renderScheduled = false;
+let searchTimer = null;
+
+// Data older than this (seconds) is flagged as stale and refreshed again shortly
+const STALE_AFTER = 300;
+const STALE_RETRY_MS = 15000;
+let staleTimer = null;
+
 // Initialize the application
 document.addEventListener('DOMContentLoaded', () => {
-    refreshData();
-    
+    const tableBody = document.getElementById('stationsTable');
+    topSpacer = createSpacer();
+    bottomSpacer = createSpacer();
+    tableBody.append(topSpacer, bottomSpacer);
+
+    // One listener for every row instead of one per row
+    tableBody.addEventListener('click', onTableClick);
+    document.getElementById('stationsViewport').addEventListener('scroll', scheduleRender, { passive: true });
+    window.addEventListener('resize', scheduleRender);
+
+    const searchInput = document.getElementById('searchInput');
     // Add enter key listener to search input
-    document.getElementById('searchInput').addEventListener('keypress', (e) => {
+    searchInput.addEventListener('keypress', (e) => {
         if (e.key === 'Enter') {
             searchStations();
         }
     });
+    // Filter as the user types, searching is local so it is cheap
+    searchInput.addEventListener('input', () => {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(searchStations, 100);
+    });
+
+    refreshData();
 });
 
-// Fetch and display all stations
+// Fetch all stations and merge them into the local store
 async function refreshData() {
-    showLoading(true);
+    showLoading(stations.size === 0);
     try {
         const response = await fetch(`${API_BASE_URL}/stations`);
-        stations = await response.json();
-        displayStations(stations);
+        updateStations(await response.json());
+        showFreshness(response.headers.get('X-Snapshot-Age'), response.headers.get('X-Snapshot-Time'));
     } catch (error) {
         console.error('Error fetching stations:', error);
         alert('Failed to fetch stations data');
@@ -28,67 +60,184 @@ async function refreshData() {
     showLoading(false);
 }
 
-// Search stations by name
-async function searchStations() {
-    const query = document.getElementById('searchInput').value.trim();
-    if (!query) {
-        refreshData();
+// Flag saved data, and ask again until the server has refreshed it
+function showFreshness(age, takenAt) {
+    const notice = document.getElementById('staleNotice');
+    clearTimeout(staleTimer);
+    if (age === null || Number(age) <= STALE_AFTER) {
+        notice.classList.add('d-none');
         return;
     }
+    const savedAt = new Date(Number(takenAt) * 1000).toLocaleString([], {
+        day: '2-digit', month: '2-digit', hour: '2-digit', minute: '2-digit'
+    });
+    notice.textContent = `Showing saved data from ${savedAt} (stale) - refreshing...`;
+    notice.classList.remove('d-none');
+    staleTimer = setTimeout(refreshData, STALE_RETRY_MS);
+}
 
-    showLoading(true);
-    try {
-        const response = await fetch(`${API_BASE_URL}/stations/search/${encodeURIComponent(query)}`);
-        const filteredStations = await response.json();
-        displayStations(filteredStations);
-    } catch (error) {
-        console.error('Error searching stations:', error);
-        alert('Failed to search stations');
+// Search stations by name, against the local index
+function searchStations() {
+    applyFilter();
+    document.getElementById('stationsViewport').scrollTop = 0;
+}
+
+// Replace the stored stations, keeping the rows already on screen
+function updateStations(stationList) {
+    const seen = new Set();
+    stationList.forEach(station => {
+        seen.add(station.stationcode);
+        stations.set(station.stationcode, station);
+    });
+    for (const code of stations.keys()) {
+        if (!seen.has(code)) {
+            stations.delete(code);
+        }
     }
-    showLoading(false);
+    buildSearchIndex();
+    applyFilter();
 }
 
-// Display stations in the table
-function displayStations(stationsToDisplay) {
-    const tableBody = document.getElementById('stationsTable');
-    tableBody.innerHTML = '';
-
-    stationsToDisplay.forEach(station => {
-        const row = document.createElement('tr');
-        row.className = 'station-row';
-        row.onclick = () => showStationDetails(station);
-
-        const isActive = station.is_installed && station.is_renting;
-        const statusClass = isActive ? 'status-active' : 'status-inactive';
-        const statusText = isActive ? 'Active' : 'Inactive';
-
-        row.innerHTML = `
-            <td>${station.name}</td>
-            <td>${station.ebike || 0}</td>
-            <td>${station.mechanical || 0}</td>
-            <td class="${statusClass}">${statusText}</td>
-            <td>
-                <button class="btn btn-sm btn-info" onclick="event.stopPropagation(); showStationDetails(${JSON.stringify(station)})">
-                    Details
-                </button>
-            </td>
-        `;
-        tableBody.appendChild(row);
+// Lower case, accent free version of a name used for matching
+function normalize(text) {
+    return (text || '').normalize('NFD').replace(/[\u0300-\u036f]/g, '').toLowerCase();
+}
+
+function buildSearchIndex() {
+    searchIndex = Array.from(stations.values(), station => [normalize(station.name), station.stationcode]);
+}
+
+function applyFilter() {
+    const query = normalize(document.getElementById('searchInput').value.trim());
+    visibleCodes = query
+        ? searchIndex.filter(([name]) => name.includes(query)).map(([, code]) => code)
+        : searchIndex.map(([, code]) => code);
+    document.getElementById('emptyMessage').classList.toggle('d-none', visibleCodes.length > 0 || stations.size === 0);
+    renderRows();
+}
+
+function scheduleRender() {
+    if (renderScheduled) return;
+    renderScheduled = true;
+    requestAnimationFrame(() => {
+        renderScheduled = false;
+        renderRows();
     });
 }
 
+// Display the stations in the viewport, reusing and patching pooled rows
+function renderRows() {
+    const viewport = document.getElementById('stationsViewport');
+    const first = Math.max(0, Math.floor(viewport.scrollTop / rowHeight) - OVERSCAN);
+    const count = Math.ceil(viewport.clientHeight / rowHeight) + 2 * OVERSCAN;
+    const last = Math.min(visibleCodes.length, first + count);
+
+    while (rowPool.length < last - first) {
+        const row = createRow();
+        bottomSpacer.before(row);
+        rowPool.push(row);
+    }
+    rowPool.forEach((row, i) => {
+        const code = visibleCodes[first + i];
+        if (first + i < last) {
+            row.hidden = false;
+            patchRow(row, stations.get(code));
+        } else {
+            row.hidden = true;
+        }
+    });
+
+    // Measure the real row height once rows are on screen
+    if (rowPool.length && !rowPool[0].hidden) {
+        const measured = rowPool[0].getBoundingClientRect().height;
+        if (measured > 0 && Math.abs(measured - rowHeight) > 0.5) {
+            rowHeight = measured;
+            scheduleRender();
+        }
+    }
+    topSpacer.firstChild.style.height = `${first * rowHeight}px`;
+    bottomSpacer.firstChild.style.height = `${(visibleCodes.length - last) * rowHeight}px`;
+}
+
+function createSpacer() {
+    const row = document.createElement('tr');
+    row.className = 'spacer-row';
+    const cell = document.createElement('td');
+    cell.colSpan = 5;
+    row.appendChild(cell);
+    return row;
+}
+
+function createRow() {
+    const row = document.createElement('tr');
+    row.className = 'station-row';
+    row.innerHTML = `
+        <td></td>
+        <td></td>
+        <td></td>
+        <td></td>
+        <td>
+            <button class="btn btn-sm btn-info" data-action="details">
+                Details
+            </button>
+        </td>
+    `;
+    return row;
+}
+
+// Only touch the cells whose content changed
+function setText(cell, value) {
+    const text = String(value);
+    if (cell.textContent !== text) {
+        cell.textContent = text;
+    }
+}
+
+function patchRow(row, station) {
+    if (row.dataset.code !== station.stationcode) {
+        row.dataset.code = station.stationcode;
+    }
+    const cells = row.cells;
+    const isActive = isYes(station.is_installed) && isYes(station.is_renting);
+    setText(cells[0], station.name);
+    setText(cells[1], station.ebike || 0);
+    setText(cells[2], station.mechanical || 0);
+    setText(cells[3], isActive ? 'Active' : 'Inactive');
+    cells[3].className = isActive ? 'status-active' : 'status-inactive';
+}
+
+function onTableClick(event) {
+    const row = event.target.closest('tr.station-row');
+    if (!row) return;
+    const station = stations.get(row.dataset.code);
+    if (station) {
+        showStationDetails(station);
+    }
+}
+
+// Status fields come as "OUI"/"NON" from the API
+function isYes(value) {
+    return value === true || value === 1 || value === 'OUI';
+}
+
+function escapeHtml(value) {
+    const div = document.createElement('div');
+    div.textContent = value == null ? '' : String(value);
+    return div.innerHTML;
+}
+
 // Show station details in modal
 function showStationDetails(station) {
     const modalBody = document.getElementById('stationDetails');
-    const isActive = station.is_installed && station.is_renting;
-    
+    const isActive = isYes(station.is_installed) && isYes(station.is_renting);
+
     // Create bike lists
     const ebikes = station.bikes?.filter(bike => bike.type === 'E-Bike') || [];
     const mechanical = station.bikes?.filter(bike => bike.type === 'Mechanical') || [];
-    
+
     modalBody.innerHTML = `
         <div class="bike-info">
-            <h5>${station.name}</h5>
+            <h5>${escapeHtml(station.name)}</h5>
             <div class="mb-3">
                 <span class="status-indicator ${isActive ? 'active' : 'inactive'}"></span>
                 Status: ${isActive ? 'Active' : 'Inactive'}
@@ -99,7 +248,7 @@ function showStationDetails(station) {
                     <div class="bike-list">
                         ${ebikes.map(bike => `
                             <div class="bike-item">
-                                Bike #${bike.number} - ${bike.status}
+                                Bike #${escapeHtml(bike.number)} - ${escapeHtml(bike.status)}
                             </div>
                         `).join('')}
                     </div>
@@ -109,7 +258,7 @@ function showStationDetails(station) {
                     <div class="bike-list">
                         ${mechanical.map(bike => `
                             <div class="bike-item">
-                                Bike #${bike.number} - ${bike.status}
+                                Bike #${escapeHtml(bike.number)} - ${escapeHtml(bike.status)}
                             </div>
                         `).join('')}
                     </div>
@@ -127,7 +276,7 @@ function showStationDetails(station) {
     `;
 
     // Show the modal
-    const modal = new bootstrap.Modal(document.getElementById('stationModal'));
+    const modal = bootstrap.Modal.getOrCreateInstance(document.getElementById('stationModal'));
     modal.show();
 }
 
@@ -135,4 +284,4 @@ function showStationDetails(station) {
 function showLoading(show) {
     const loadingElement = document.getElementById('loading');
     loadingElement.classList.toggle('d-none', !show);
-} 
\ No newline at end of file
+}